@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_canonical
+----------------------------------
+
+Measure the cost of the canonical order mode: the time spent sorting
+service and machine names when the change set is created, compared with
+the time spent running the handlers.
+
+Run with `python -m benchmarks.bench_canonical`.
+"""
+
+from __future__ import print_function
+
+import random
+import timeit
+
+from bundleparser import parse
+
+
+# (number of services, number of machines)
+SIZES = ((100, 100), (1000, 1000), (10000, 10000))
+REPEAT = 5
+
+
+def make_bundle(services, machines):
+    service_names = ['service-{}'.format(i) for i in range(services)]
+    machine_names = [str(i) for i in range(machines)]
+    rnd = random.Random(42)
+    rnd.shuffle(service_names)
+    rnd.shuffle(machine_names)
+    return {
+        'services': dict(
+            (name, {
+                'charm': 'cs:trusty/charm-{}'.format(i % 50),
+                'num_units': 2,
+                'to': machine_names[i % machines],
+            }) for i, name in enumerate(service_names)),
+        'machines': dict(
+            (name, {'series': 'trusty'}) for name in machine_names),
+        'relations': [],
+    }
+
+
+def consume(bundle, canonical):
+    for _ in parse.parse(bundle, canonical=canonical):
+        pass
+
+
+def main():
+    for services, machines in SIZES:
+        bundle = make_bundle(services, machines)
+        results = []
+        for func in (
+                lambda: parse.ChangeSet(bundle),
+                lambda: parse.ChangeSet(bundle, canonical=True),
+                lambda: consume(bundle, False),
+                lambda: consume(bundle, True)):
+            results.append(
+                min(timeit.repeat(func, number=1, repeat=REPEAT)) * 1000)
+        print('{:>5} services, {:>5} machines: setup {:7.2f} ms, '
+              'canonical setup {:7.2f} ms, parse {:8.2f} ms, '
+              'canonical parse {:8.2f} ms'.format(
+                  services, machines, *results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_columnar
+----------------------------------
+
+Compare aggregate queries (method mix, requires fan-in, units per machine)
+over many change sets stored in the columnar layout with the same queries
+over the equivalent JSON documents.
+
+Run with `python -m benchmarks.bench_columnar`.
+"""
+
+from __future__ import print_function
+
+from collections import Counter
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from bundleparser import (
+    columnar,
+    parse,
+)
+
+
+CHANGESETS = 2000
+
+
+def make_bundle(seed):
+    machines = dict((str(i), {'series': 'trusty'}) for i in range(seed % 5))
+    services = {}
+    for i in range(5 + seed % 20):
+        service = {
+            'charm': 'cs:trusty/charm-{}'.format(i % 7),
+            'num_units': 1 + (seed + i) % 10,
+        }
+        if machines:
+            service['to'] = str(i % len(machines))
+        services['service-{}'.format(i)] = service
+    bundle = {
+        'services': services,
+        'relations': [
+            ['service-{}:db'.format(i), 'service-{}:db'.format(i + 1)]
+            for i in range(len(services) - 1)],
+    }
+    if machines:
+        bundle['machines'] = machines
+    return bundle
+
+
+def json_queries(paths):
+    methods, fan_in, units = Counter(), Counter(), Counter()
+    for path in paths:
+        with open(path) as f:
+            changes = json.load(f)
+        by_id = dict((change['id'], change) for change in changes)
+        for change in changes:
+            methods[change['method']] += 1
+            for required in change['requires']:
+                fan_in[(path, required)] += 1
+                if (change['method'] == 'addUnit' and
+                        by_id[required]['method'] == 'addMachine'):
+                    units[(path, required)] += 1
+    return methods, fan_in, units
+
+
+def columnar_queries(directory):
+    with columnar.ColumnarChangeSets(directory) as store:
+        return (
+            store.method_counts(), store.fan_in(), store.units_per_machine())
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        changesets = [
+            list(parse.parse(make_bundle(seed))) for seed in range(CHANGESETS)]
+        total = sum(len(changes) for changes in changesets)
+        paths = []
+        start = time.time()
+        for num, changes in enumerate(changesets):
+            path = os.path.join(directory, '{}.json'.format(num))
+            with open(path, 'w') as f:
+                json.dump(changes, f)
+            paths.append(path)
+        json_write = time.time() - start
+        start = time.time()
+        columnar.export(changesets, os.path.join(directory, 'columns'))
+        columnar_write = time.time() - start
+
+        start = time.time()
+        expected = json_queries(paths)
+        json_query = time.time() - start
+        start = time.time()
+        result = columnar_queries(os.path.join(directory, 'columns'))
+        columnar_query = time.time() - start
+        assert expected[0] == result[0]
+        assert sorted(expected[1].values()) == sorted(result[1].values())
+        assert sorted(expected[2].values()) == sorted(result[2].values())
+
+        print('{} change sets, {} changes'.format(CHANGESETS, total))
+        print('json:     write {:8.2f} ms, query {:8.2f} ms'.format(
+            json_write * 1000, json_query * 1000))
+        print('columnar: write {:8.2f} ms, query {:8.2f} ms'.format(
+            columnar_write * 1000, columnar_query * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_flatten
+----------------------------------
+
+Time the flattening of version 3 bundle files with deep inheritance chains
+and hundreds of derived bundles, compared with a naive implementation
+resolving every bundle from scratch using deep copies. Parsing all the
+flattened bundles is timed as well.
+
+Run with `python -m benchmarks.bench_flatten`.
+"""
+
+from __future__ import print_function
+
+import copy
+import timeit
+
+from bundleparser import flatten
+
+
+# (inheritance chain depth, number of bundles derived from each chain link,
+# number of services in the base bundle)
+CASES = (
+    (10, 20, 50),
+    (50, 5, 20),
+    (200, 1, 10),
+)
+REPEAT = 3
+
+
+def make_bundles(depth, derived, services):
+    bundles = {'base': {
+        'series': 'trusty',
+        'services': dict(
+            ('service-{}'.format(i), {
+                'charm': 'cs:trusty/charm-{}'.format(i),
+                'num_units': 1,
+                'options': {'setting': 'x' * 256, 'index': i},
+            }) for i in range(services)),
+        'relations': [
+            ['service-{}:db'.format(i), 'service-{}:db'.format(i + 1)]
+            for i in range(services - 1)],
+    }}
+    parent = 'base'
+    for level in range(depth):
+        name = 'level-{}'.format(level)
+        bundles[name] = {
+            'inherits': parent,
+            'services': {
+                'service-{}'.format(level % services): {
+                    'num_units': level + 2,
+                    'options': {'index': -level},
+                },
+            },
+        }
+        for i in range(derived):
+            bundles['{}-derived-{}'.format(name, i)] = {
+                'inherits': name,
+                'services': {'extra-{}'.format(i): {
+                    'charm': 'cs:trusty/extra-{}'.format(i), 'num_units': 1}},
+            }
+        parent = name
+    return bundles
+
+
+def naive_resolve(bundles, name):
+    bundle = copy.deepcopy(bundles[name])
+    parent = bundle.pop('inherits', None)
+    if parent is None:
+        return bundle
+    return naive_merge(naive_resolve(bundles, parent), bundle, True)
+
+
+def naive_merge(base, override, top=False):
+    result = copy.deepcopy(base)
+    for key, value in override.items():
+        if top and key == 'relations' and key in result:
+            result[key].extend(r for r in value if r not in result[key])
+        elif isinstance(result.get(key), dict) and isinstance(value, dict):
+            result[key] = naive_merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def naive(bundles):
+    return dict((name, naive_resolve(bundles, name)) for name in bundles)
+
+
+def parse_all(bundles):
+    for _, changes in flatten.parse_bundles(bundles):
+        for _ in changes:
+            pass
+
+
+def main():
+    for depth, derived, services in CASES:
+        bundles = make_bundles(depth, derived, services)
+        assert flatten.flatten(bundles) == naive(bundles)
+        times = [
+            min(timeit.repeat(
+                lambda: func(bundles), number=1, repeat=REPEAT))
+            for func in (flatten.flatten, naive, parse_all)]
+        print('depth {:>3}, {:>4} bundles: flatten {:8.2f} ms, '
+              'naive {:9.2f} ms, flatten and parse {:9.2f} ms'.format(
+                  depth, len(bundles), *[t * 1000 for t in times]))
+
+
+if __name__ == '__main__':
+    main()
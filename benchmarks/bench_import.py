@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_import
+----------------------------------
+
+Track the import time of each public bundleparser module.
+
+Every module is imported in a fresh interpreter so that nothing is cached.
+Absolute times vary too much between machines and runs to be compared with
+fixed limits, so the cost of an import is measured as the extra time taken
+by `python -c "import <module>"` over `python -c pass`, both run in pairs in
+the same session, and the median cost is compared with a threshold
+expressed as a fraction of that baseline. The package is byte-compiled
+first, so that compilation is never measured. The script exits with an
+error if any threshold is exceeded or if a module drags in one of the heavy
+modules listed below.
+
+Run with `python -m benchmarks.bench_import`.
+"""
+
+from __future__ import print_function
+
+import compileall
+import os
+import subprocess
+import sys
+import time
+
+import bundleparser
+
+
+# Maximum import cost of each public module, as a fraction of the time taken
+# to start an interpreter and run `pass`. Each threshold is the measured cost
+# plus a margin of about 0.1, above the noise observed between runs.
+THRESHOLDS = {
+    'bundleparser': 0.15,
+    'bundleparser.bundleparser': 0.45,
+    'bundleparser.columnar': 0.4,
+    'bundleparser.constraints': 0.15,
+    'bundleparser.flatten': 0.45,
+    'bundleparser.graph': 0.45,
+    'bundleparser.options': 0.15,
+    'bundleparser.parse': 0.45,
+    'bundleparser.validate': 0.15,
+}
+
+# Modules that must not be imported as a side effect of importing the
+# bundleparser package or any of its public modules.
+HEAVY_MODULES = ('yaml', 'json')
+
+RUNS = 20
+
+# Use the most precise clock available.
+timer = getattr(time, 'perf_counter', time.time)
+
+SNIPPET = """
+import sys
+import {module}
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(','.join(heavy))
+"""
+
+
+def _elapsed(code):
+    """Return the wall time taken to run code in a fresh interpreter, and
+    its output.
+    """
+    start = timer()
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return timer() - start, output
+
+
+def measure(module, runs=RUNS):
+    """Return the import cost of module and the heavy modules it loads.
+
+    The module import and the `pass` baseline run in pairs, so that both
+    are timed under the same machine load. The cost is the median over the
+    pairs of the difference between them, as a fraction of the baseline.
+    """
+    code = SNIPPET.format(module=module, heavy=HEAVY_MODULES)
+    ratios = []
+    for _ in range(runs):
+        elapsed, output = _elapsed(code)
+        baseline = _elapsed('pass')[0]
+        ratios.append((elapsed - baseline) / baseline)
+    ratios.sort()
+    heavy = [name for name in output.decode('ascii').strip().split(',')
+             if name]
+    return max(ratios[len(ratios) // 2], 0), heavy
+
+
+def main():
+    # Byte-compile the package first, so that compilation is not measured
+    # when bytecode caches are missing, stale or not written.
+    package = os.path.dirname(os.path.abspath(bundleparser.__file__))
+    compileall.compile_dir(package, quiet=1)
+    failures = []
+    for module in sorted(THRESHOLDS):
+        ratio, heavy = measure(module)
+        threshold = THRESHOLDS[module]
+        print('{:<28} {:5.2f}x baseline (threshold {}x)'.format(
+            module, ratio, threshold))
+        if ratio > threshold:
+            failures.append(
+                '{}: import took {:.2f}x the baseline'.format(module, ratio))
+        if heavy:
+            failures.append('{}: imports {}'.format(module, ', '.join(heavy)))
+    if failures:
+        sys.exit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
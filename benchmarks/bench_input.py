@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_input
+----------------------------------
+
+Compare ways of loading a large bundle from disk, and hashing its content:
+reading it as text and decoding it with the pure Python yaml.safe_load, or
+with the C loader used by load_bundle, and the memory-mapped
+load_bundle_file, with YAML and JSON bundle files.
+
+Most of the gain for YAML files comes from the C loader, which is used for
+both text and memory-mapped input: compare the second and third cases to
+see what memory-mapping alone brings.
+
+Run with `python -m benchmarks.bench_input`.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import timeit
+
+import yaml
+
+from bundleparser.bundleparser import (
+    load_bundle,
+    load_bundle_file,
+)
+
+
+SERVICES = 5000
+REPEAT = 3
+
+
+def make_bundle():
+    return {
+        'series': 'trusty',
+        'services': dict(
+            ('service-{}'.format(i), {
+                'charm': 'cs:trusty/charm-{}'.format(i % 20),
+                'num_units': i % 5,
+                'options': {'key': 'value-{}'.format(i), 'port': 8000 + i},
+                'to': [str(i % 100)],
+            }) for i in range(SERVICES)),
+        'machines': dict((str(i), {'series': 'trusty'}) for i in range(100)),
+        'relations': [
+            ['service-{}:db'.format(i), 'service-{}:db'.format(i + 1)]
+            for i in range(SERVICES - 1)],
+    }
+
+
+def text_load(path, load=yaml.safe_load):
+    with open(path) as f:
+        content = f.read()
+    hashlib.sha256(content.encode('utf-8')).hexdigest()
+    return load(content)
+
+
+def text_load_bundle(path):
+    return text_load(path, load=load_bundle)
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        bundle = make_bundle()
+        yaml_path = os.path.join(directory, 'bundle.yaml')
+        json_path = os.path.join(directory, 'bundle.json')
+        with open(yaml_path, 'w') as f:
+            yaml.safe_dump(bundle, f, default_flow_style=False)
+        with open(json_path, 'w') as f:
+            json.dump(bundle, f)
+        assert load_bundle_file(yaml_path)[0] == bundle
+        assert load_bundle_file(json_path)[0] == bundle
+        for name, func, path in (
+                ('text + safe_load', text_load, yaml_path),
+                ('text + load_bundle', text_load_bundle, yaml_path),
+                ('load_bundle_file', load_bundle_file, yaml_path),
+                ('load_bundle_file', load_bundle_file, json_path)):
+            elapsed = min(timeit.repeat(
+                lambda: func(path), number=1, repeat=REPEAT))
+            print('{:<20} {:<12} {:>9,} bytes {:9.2f} ms'.format(
+                name, os.path.basename(path), os.path.getsize(path),
+                elapsed * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_machines
+----------------------------------
+
+Time handle_machines and group_machines on bundles with thousands of
+machines, with and without the constraint memo table.
+
+Run with `python -m benchmarks.bench_machines`.
+"""
+
+from __future__ import print_function
+
+import timeit
+
+from bundleparser import (
+    constraints,
+    parse,
+)
+
+
+SIZES = (1000, 10000, 50000)
+REPEAT = 5
+
+# A realistic mix: most machines share a handful of specs.
+SPECS = (
+    {'series': 'trusty', 'constraints': 'mem=4G cores=2 arch=amd64'},
+    {'series': 'trusty', 'constraints': 'mem=16G cores=8 root-disk=100G'},
+    {'series': 'xenial', 'constraints': 'mem=2G tags=web,frontend'},
+    {'series': 'xenial'},
+)
+
+
+def make_bundle(size):
+    return {
+        'services': {},
+        'machines': dict(
+            (str(i), dict(SPECS[i % len(SPECS)])) for i in range(size)),
+    }
+
+
+def run(bundle, cold):
+    if cold:
+        constraints._cache.clear()
+    cs = parse.ChangeSet(bundle)
+    parse.handle_machines(cs)
+    return parse.group_machines(cs.recv())
+
+
+def uncached(bundle):
+    """Run the handler clearing the memo table before every machine."""
+    parse_constraints = constraints.parse_constraints
+
+    def clearing(value):
+        constraints._cache.clear()
+        return parse_constraints(value)
+
+    parse.parse_constraints = clearing
+    try:
+        run(bundle, True)
+    finally:
+        parse.parse_constraints = parse_constraints
+
+
+def main():
+    for size in SIZES:
+        bundle = make_bundle(size)
+        memo = min(timeit.repeat(
+            lambda: run(bundle, True), number=1, repeat=REPEAT))
+        nomemo = min(timeit.repeat(
+            lambda: uncached(bundle), number=1, repeat=REPEAT))
+        groups = len(run(bundle, True))
+        print('{:>6} machines, {} groups: {:8.2f} ms memoized, '
+              '{:8.2f} ms unmemoized'.format(
+                  size, groups, memo * 1000, nomemo * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_options
+----------------------------------
+
+Compare output size and serialization time of the plain and shared options
+output modes, on bundles where many services carry the same large options
+payloads (configuration files and certificates). Services sharing a payload
+share the same dict object, as they do when the bundle uses YAML aliases.
+
+Run with `python -m benchmarks.bench_options`.
+"""
+
+from __future__ import print_function
+
+import random
+import string
+import timeit
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from bundleparser import (
+    options,
+    parse,
+)
+from bundleparser.bundleparser import dump_changes
+
+
+# (number of services, number of distinct options blobs, blob size in bytes)
+CASES = (
+    (100, 5, 4096),
+    (1000, 10, 16384),
+    (1000, 100, 65536),
+)
+REPEAT = 3
+
+
+def make_blob(size, seed):
+    rnd = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + '+/'
+    body = ''.join(rnd.choice(alphabet) for _ in range(size))
+    return {
+        'ssl_cert': '-----BEGIN CERTIFICATE-----\n' + body,
+        'config_file': body[::-1],
+        'port': 443,
+    }
+
+
+def make_changes(services, blobs, size):
+    payloads = [make_blob(size // 2, seed) for seed in range(blobs)]
+    bundle = {'services': dict(
+        ('service-{}'.format(i), {
+            'charm': 'cs:trusty/apache2-{}'.format(i % 7),
+            'options': payloads[i % blobs],
+        }) for i in range(services))}
+    cs = parse.ChangeSet(bundle)
+    parse.handle_services(cs)
+    return cs.recv()
+
+
+def plain(changes):
+    stream = StringIO()
+    dump_changes(changes, stream)
+    return stream.getvalue()
+
+
+def shared(changes):
+    stream = StringIO()
+    table = {}
+    dump_changes(options.share_options(changes, table), stream, table)
+    return stream.getvalue()
+
+
+def main():
+    for services, blobs, size in CASES:
+        changes = make_changes(services, blobs, size)
+        results = []
+        for mode in (plain, shared):
+            elapsed = min(timeit.repeat(
+                lambda: mode(changes), number=1, repeat=REPEAT))
+            results.append((len(mode(changes)), elapsed))
+        print('{:>5} services, {:>3} blobs of {:>5} bytes: '
+              'plain {:>11,} bytes {:8.2f} ms, '
+              'shared {:>10,} bytes {:8.2f} ms'.format(
+                  services, blobs, size,
+                  results[0][0], results[0][1] * 1000,
+                  results[1][0], results[1][1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
-import sys
+"""Command line layer for the bundle parser.
+
+The library itself lives in the parse module, which is kept free of heavy
+imports. YAML loaders and JSON serializers are only imported here, lazily,
+the first time they are actually needed.
+"""
 
-import json
-import yaml
+import os
+import sys
 
 from . import (
     parse,
@@ -9,19 +14,151 @@ from . import (
 )
 
 
+# The number of bytes read at a time from memory-mapped bundle files.
+CHUNK_SIZE = 64 * 1024
+
+
+def _yaml_loader():
+    """Return the PyYAML C safe loader, or the Python one if unavailable."""
+    import yaml
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def load_bundle(stream):
+    """Return the bundle decoded from the given YAML stream."""
+    import yaml
+    return yaml.load(stream, Loader=_yaml_loader())
+
+
+class _HashingReader(object):
+    """A file-like object reading bytes from a buffer.
+
+    The bytes are added to the given hash object as they are read, so that
+    the buffer is only scanned once.
+    """
+
+    def __init__(self, data, digest):
+        self._data = data
+        self._position = 0
+        self.digest = digest
+
+    def read(self, size=-1):
+        start = self._position
+        end = len(self._data) if size < 0 else min(
+            start + size, len(self._data))
+        chunk = self._data[start:end]
+        self._position = end
+        self.digest.update(chunk)
+        return chunk
+
+    def finish(self):
+        """Hash the bytes which have not been read yet."""
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+def _looks_like_json(path, data):
+    """Return whether the bundle file content is likely to be JSON."""
+    if path.endswith('.json'):
+        return True
+    return data[:CHUNK_SIZE].lstrip()[:1] == b'{'
+
+
+def load_bundle_file(path):
+    """Return the bundle stored in the file at path, and the file hash.
+
+    The file is memory-mapped. YAML bundles are fed in chunks to the PyYAML
+    C loader, when available, and the chunks are hashed as they are read.
+    The json module cannot decode incrementally, so JSON bundles, detected
+    from their content, are copied out of the map once and decoded in one
+    go, and the map itself is hashed. The hash is the SHA-256 hex digest of
+    the file bytes, and can be used as a content cache key.
+    """
+    import hashlib
+    import mmap
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # Empty files cannot be memory-mapped.
+            return load_bundle(f), hashlib.sha256().hexdigest()
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if _looks_like_json(path, data):
+            import json
+            try:
+                bundle = json.loads(data[:].decode('utf-8'))
+            except ValueError:
+                # Not JSON after all, e.g. a YAML flow mapping.
+                pass
+            else:
+                return bundle, hashlib.sha256(data).hexdigest()
+        import yaml
+        reader = _HashingReader(data, hashlib.sha256())
+        bundle = yaml.load(reader, Loader=_yaml_loader())
+        reader.finish()
+        return bundle, reader.digest.hexdigest()
+    finally:
+        data.close()
+
+
+def dump_changes(changes, stream, options=None, sort_keys=False):
+    """Write the given changes to stream as a JSON list.
+
+    If an options table is provided, write a JSON object instead, holding
+    the changes list and, once all changes are written, the options table.
+    If sort_keys is True, dict keys are sorted in the output.
+    """
+    import json
+    stream.write('{\n"changes": [\n' if options is not None else '[\n')
+    for num, change in enumerate(changes):
+        if num:
+            stream.write(',\n')
+        stream.write(json.dumps(change, indent=4, sort_keys=sort_keys))
+    stream.write('\n]\n')
+    if options is not None:
+        stream.write(',\n"options": {}\n}}\n'.format(
+            json.dumps(options, indent=4, sort_keys=sort_keys)))
+
+
+def get_parser():
+    """Return the command line arguments parser."""
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Parse a Juju bundle into a list of changes, written to '
+                    'stdout as JSON.')
+    parser.add_argument(
+        'bundle', nargs='?', default='-',
+        help='the YAML or JSON bundle file, read from stdin if omitted')
+    parser.add_argument(
+        '--share-options', action='store_true',
+        help='store each distinct service options dict once in a side '
+             'table, and refer to it by key in deploy changes')
+    parser.add_argument(
+        '--canonical', action='store_true',
+        help='produce the same output for equal bundles, regardless of the '
+             'order of their services, machines and keys')
+    return parser
+
+
 def main():
-    bundle = yaml.safe_load(sys.stdin)
+    args = get_parser().parse_args()
+    if args.bundle == '-':
+        bundle = load_bundle(sys.stdin)
+    else:
+        bundle, _ = load_bundle_file(args.bundle)
 
     errors = validate.validate_bundle(bundle)
     if errors:
         sys.exit(errors)
 
-    print('[')
-    for num, change in enumerate(parse.parse(bundle)):
-        if num:
-            print(',')
-        print(json.dumps(change, indent=4))
-    print(']')
+    changes = parse.parse(bundle, canonical=args.canonical)
+    table = None
+    if args.share_options:
+        from .options import share_options
+        table = {}
+        changes = share_options(changes, table)
+    dump_changes(
+        changes, sys.stdout, options=table, sort_keys=args.canonical)
+
 
 if __name__ == '__main__':
     main()
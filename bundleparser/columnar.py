@@ -0,0 +1,247 @@
+"""Export change sets in a columnar layout for analytics.
+
+Many change sets are stored in a single directory, one binary file per
+column, plus a JSON metadata file. Columns are plain typed arrays written
+with the array module, so that they can be memory-mapped and queried
+without building a dict for each change:
+
+- changesets: offsets of the first change of each change set (uint32);
+- method: the method code of each change (uint8);
+- prefix: the id prefix code of each change, e.g. "addService" (uint8);
+- number: the id number of each change (uint32);
+- requires_offsets: offsets into requires for each change (uint32);
+- requires: the rows of the changes each change requires (uint32).
+
+Change ids are "<prefix>-<number>" strings. Rows are global across all
+the change sets stored in the same directory.
+"""
+
+from array import array
+from collections import Counter
+import mmap
+import os
+import sys
+
+
+META_FILE = 'meta.json'
+VERSION = 1
+
+# Map column names to their array type codes.
+COLUMNS = {
+    'changesets': 'I',
+    'method': 'B',
+    'prefix': 'B',
+    'number': 'I',
+    'requires_offsets': 'I',
+    'requires': 'I',
+}
+
+
+def _code(codes, value):
+    """Return the code for value, adding it to the codes dict if required."""
+    code = codes.get(value)
+    if code is None:
+        code = codes[value] = len(codes)
+        if code > 255:
+            raise ValueError('too many distinct values: {!r}'.format(value))
+    return code
+
+
+def _split_id(change_id):
+    """Return the (prefix, number) pair for the given change id."""
+    prefix, _, number = change_id.rpartition('-')
+    if not prefix or not number.isdigit():
+        raise ValueError('invalid change id: {!r}'.format(change_id))
+    return prefix, int(number)
+
+
+def export(changesets, directory):
+    """Write the given change sets to directory in a columnar layout.
+
+    The changesets argument is an iterable of change sets, each one being an
+    iterable of changes as yielded by parse.parse(). The directory is created
+    if it does not exist. Return the total number of changes written.
+    """
+    # Imported here so that importing this module stays cheap.
+    import json
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    methods, prefixes = {}, {}
+    files = dict(
+        (name, open(os.path.join(directory, name), 'wb'))
+        for name in COLUMNS)
+    rows = requires_count = changeset_count = 0
+    try:
+        for changes in changesets:
+            array(COLUMNS['changesets'], [rows]).tofile(files['changesets'])
+            changeset_count += 1
+            changes = list(changes)
+            columns = dict((name, array(COLUMNS[name])) for name in COLUMNS)
+            positions = {}
+            for position, change in enumerate(changes):
+                positions[change['id']] = rows + position
+                prefix, number = _split_id(change['id'])
+                columns['prefix'].append(_code(prefixes, prefix))
+                columns['number'].append(number)
+                columns['method'].append(_code(methods, change['method']))
+            for change in changes:
+                columns['requires_offsets'].append(requires_count)
+                for required in change['requires']:
+                    try:
+                        columns['requires'].append(positions[required])
+                    except KeyError:
+                        raise ValueError(
+                            'change {} requires unknown change {}'.format(
+                                change['id'], required))
+                requires_count += len(change['requires'])
+            rows += len(changes)
+            for name in ('method', 'prefix', 'number', 'requires_offsets',
+                         'requires'):
+                columns[name].tofile(files[name])
+        # Close the offset columns.
+        array(COLUMNS['changesets'], [rows]).tofile(files['changesets'])
+        array(COLUMNS['requires_offsets'], [requires_count]).tofile(
+            files['requires_offsets'])
+    finally:
+        for f in files.values():
+            f.close()
+    meta = {
+        'version': VERSION,
+        'byteorder': sys.byteorder,
+        'columns': dict(
+            (name, [typecode, array(typecode).itemsize])
+            for name, typecode in COLUMNS.items()),
+        'methods': sorted(methods, key=methods.get),
+        'prefixes': sorted(prefixes, key=prefixes.get),
+        'changesets': changeset_count,
+        'changes': rows,
+    }
+    with open(os.path.join(directory, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=4)
+    return rows
+
+
+class ColumnarChangeSets(object):
+    """Query change sets exported with export(), without decoding them.
+
+    Columns are memory-mapped when possible. Rows are global indexes of
+    changes across all the stored change sets.
+    """
+
+    def __init__(self, directory):
+        import json
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta['version'] != VERSION:
+            raise ValueError(
+                'unsupported columnar version: {}'.format(meta['version']))
+        self.methods = meta['methods']
+        self.prefixes = meta['prefixes']
+        self._maps = []
+        swap = meta['byteorder'] != sys.byteorder
+        self._columns = {}
+        for name, (typecode, itemsize) in meta['columns'].items():
+            if array(typecode).itemsize != itemsize:
+                raise ValueError('incompatible column: {}'.format(name))
+            self._columns[name] = self._load(
+                os.path.join(directory, name), typecode, swap)
+        self._changesets = self._columns['changesets']
+        self._method = self._columns['method']
+        self._prefix = self._columns['prefix']
+        self._number = self._columns['number']
+        self._offsets = self._columns['requires_offsets']
+        self._requires = self._columns['requires']
+
+    def _load(self, path, typecode, swap):
+        """Return the column stored at path as a sequence of numbers.
+
+        Memory-map the file when possible, falling back to reading it in an
+        array for empty files, foreign byte orders and old Pythons.
+        """
+        size = os.path.getsize(path)
+        if size and not swap and hasattr(memoryview, 'cast'):
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.append(mapped)
+            return memoryview(mapped).cast(typecode)
+        column = array(typecode)
+        with open(path, 'rb') as f:
+            column.fromfile(f, size // column.itemsize)
+        if swap:
+            column.byteswap()
+        return column
+
+    def close(self):
+        """Release the memory-mapped columns."""
+        for column in self._columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self._columns = {}
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        """Return the total number of changes."""
+        return len(self._method)
+
+    def changeset_count(self):
+        """Return the number of stored change sets."""
+        return len(self._changesets) - 1
+
+    def changeset_rows(self, index):
+        """Return the range of rows of the change set at the given index."""
+        return range(self._changesets[index], self._changesets[index + 1])
+
+    def id(self, row):
+        """Return the id of the change at the given row."""
+        return '{}-{}'.format(
+            self.prefixes[self._prefix[row]], self._number[row])
+
+    def method(self, row):
+        """Return the method of the change at the given row."""
+        return self.methods[self._method[row]]
+
+    def requires(self, row):
+        """Return a tuple of the rows of the changes required by the given row.
+
+        A copy is returned so that no view on the memory-mapped columns
+        outlives the store, which would prevent closing it.
+        """
+        return tuple(
+            self._requires[self._offsets[row]:self._offsets[row + 1]])
+
+    def method_counts(self):
+        """Return a Counter mapping methods to their number of changes."""
+        counts = Counter(self._method)
+        return Counter(dict(
+            (self.methods[code], count) for code, count in counts.items()))
+
+    def fan_in(self):
+        """Return a Counter mapping rows to the number of changes requiring
+        them. Rows not required by any change are omitted.
+        """
+        return Counter(self._requires)
+
+    def units_per_machine(self):
+        """Return a Counter mapping addMachine rows to their number of units.
+        """
+        counts = Counter()
+        if 'addUnit' not in self.methods or 'addMachine' not in self.methods:
+            return counts
+        unit = self.methods.index('addUnit')
+        machine = self.methods.index('addMachine')
+        method, offsets, requires = self._method, self._offsets, self._requires
+        for row in range(len(method)):
+            if method[row] != unit:
+                continue
+            for required in requires[offsets[row]:offsets[row + 1]]:
+                if method[required] == machine:
+                    counts[required] += 1
+        return counts
@@ -0,0 +1,173 @@
+"""Parse and normalize Juju machine constraints.
+
+Constraints can be given either as a string (e.g. "mem=4G cores=2") or as an
+already decoded dict. In both cases the result is a dict mapping constraint
+names to normalized values: sizes are converted to megabytes, counts to
+integers and list-valued constraints to lists of strings. Unknown
+constraints are passed through unchanged. So are invalid values, unless
+strict parsing is requested, as done by validate_bundle.
+"""
+
+import math
+
+
+# Map size suffixes to their multiplier, in megabytes.
+SIZE_MULTIPLIERS = {
+    'M': 1,
+    'G': 1024,
+    'T': 1024 * 1024,
+    'P': 1024 * 1024 * 1024,
+}
+
+SIZE_CONSTRAINTS = frozenset(['mem', 'root-disk'])
+INTEGER_CONSTRAINTS = frozenset(['cores', 'cpu-cores', 'cpu-power'])
+LIST_CONSTRAINTS = frozenset(['spaces', 'tags', 'zones'])
+STRING_CONSTRAINTS = frozenset([
+    'arch', 'container', 'instance-type', 'virt-type'])
+ARCHITECTURES = frozenset([
+    'amd64', 'arm', 'arm64', 'i386', 'ppc64', 'ppc64el', 's390x'])
+
+# Parsed constraint strings, stored as tuples of (name, value) pairs.
+_cache = {}
+# The maximum number of constraint strings kept in the cache.
+CACHE_SIZE = 1024
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+
+def _parse_size(name, value):
+    """Return the given size value as an integer number of megabytes."""
+    if isinstance(value, (int, float)):
+        number, multiplier = value, 1
+    else:
+        text = str(value).strip()
+        multiplier = SIZE_MULTIPLIERS.get(text[-1:].upper())
+        if multiplier is None:
+            multiplier = 1
+        else:
+            text = text[:-1]
+        try:
+            number = float(text)
+        except ValueError:
+            raise ValueError('invalid {} constraint: {!r}'.format(name, value))
+    # Reject infinities and NaNs, which cannot be converted to integers.
+    if number != number or number in (float('inf'), float('-inf')):
+        raise ValueError('invalid {} constraint: {!r}'.format(name, value))
+    if number < 0:
+        raise ValueError('negative {} constraint: {!r}'.format(name, value))
+    return int(math.ceil(number * multiplier))
+
+
+def _parse_integer(name, value):
+    """Return the given count value as a non-negative integer."""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('invalid {} constraint: {!r}'.format(name, value))
+    if number < 0:
+        raise ValueError('negative {} constraint: {!r}'.format(name, value))
+    return number
+
+
+def _parse_list(name, value):
+    """Return the given comma separated value as a list of strings."""
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return [item.strip() for item in str(value).split(',') if item.strip()]
+
+
+def _normalize(name, value, strict):
+    """Return the normalized value for the given constraint name.
+
+    Unknown constraints are returned unchanged. Invalid values are
+    returned unchanged too, unless strict is True, in which case a
+    ValueError is raised.
+    """
+    try:
+        if name in SIZE_CONSTRAINTS:
+            return _parse_size(name, value)
+        if name in INTEGER_CONSTRAINTS:
+            return _parse_integer(name, value)
+        if name in LIST_CONSTRAINTS:
+            return _parse_list(name, value)
+        if name in STRING_CONSTRAINTS:
+            text = str(value)
+            if name == 'arch' and text not in ARCHITECTURES:
+                raise ValueError('unknown architecture: {!r}'.format(text))
+            return text
+        return value
+    except ValueError:
+        if strict:
+            raise
+        return value
+
+
+def _parse_string(constraints, strict):
+    """Return a tuple of (name, value) pairs for the given string."""
+    pairs = []
+    for item in constraints.split():
+        name, sep, value = item.partition('=')
+        if not sep or not name:
+            raise ValueError('invalid constraint: {!r}'.format(item))
+        pairs.append((name, _normalize(name, value, strict)))
+    return tuple(pairs)
+
+
+def parse_constraints(constraints, strict=False):
+    """Return a dict of normalized constraints.
+
+    The constraints argument is either a constraint string or a dict.
+    Unknown constraints are kept unchanged, as providers support more
+    constraints than the ones normalized here. If strict is True, raise a
+    ValueError if a value is not valid or if a string cannot be split into
+    name=value pairs. Otherwise, invalid values are kept unchanged, and such
+    strings are returned as is.
+    Parsed strings are memoized, so that machines sharing the same
+    constraints are only parsed once.
+    """
+    if not constraints:
+        return {}
+    if not isinstance(constraints, _string_types):
+        return dict(
+            (name, _normalize(name, value, strict))
+            for name, value in constraints.items())
+    pairs = _cache.get((constraints, strict))
+    if pairs is None:
+        try:
+            pairs = _parse_string(constraints, strict)
+        except ValueError:
+            if strict:
+                raise
+            return constraints
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+        _cache[(constraints, strict)] = pairs
+    # Lists are copied so that callers cannot alter the cached values.
+    return dict(
+        (name, list(value) if isinstance(value, list) else value)
+        for name, value in pairs)
+
+
+def _freeze(value):
+    """Return a hashable version of the given constraint value."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+def constraints_key(constraints):
+    """Return a hashable key for the given normalized constraints dict.
+
+    Equal constraints always produce the same key, including when unknown
+    constraints hold lists or dicts. Constraint strings which could not be
+    parsed are their own key.
+    """
+    if not isinstance(constraints, dict):
+        return constraints
+    return _freeze(constraints)
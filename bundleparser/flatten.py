@@ -0,0 +1,189 @@
+"""Flatten version 3 bundle files holding multiple bundles.
+
+A version 3 bundle file maps bundle names to bundles, and a bundle can
+inherit from one or more other bundles using the "inherits" key. Flattening
+a bundle merges its ancestors into it, producing a single bundle dict that
+can be passed to parse.parse(). Relations between an endpoint and a list of
+endpoints are expanded into pairwise relations.
+
+Merging is done with structural sharing: only the dicts along the paths
+overridden by a bundle are copied, everything else is shared with its
+parents. Resolved bundles must therefore be treated as read-only.
+"""
+
+from collections import OrderedDict
+
+from . import parse
+
+
+def _endpoints(endpoint):
+    """Return the list of endpoints in a possibly nested relation entry."""
+    if isinstance(endpoint, (list, tuple)):
+        return [item for entry in endpoint for item in _endpoints(entry)]
+    return [endpoint]
+
+
+def _relation_key(relation):
+    """Return a hashable key for the given relation.
+
+    The order of the endpoints does not matter, so that a relation and the
+    same relation given the other way round have the same key.
+    """
+    return tuple(sorted(_endpoints(relation)))
+
+
+def _combine_relations(base, override):
+    """Return the base relations extended with new override relations."""
+    seen = set(_relation_key(relation) for relation in base)
+    combined = list(base)
+    for relation in override:
+        key = _relation_key(relation)
+        if key not in seen:
+            seen.add(key)
+            combined.append(relation)
+    return combined
+
+
+def _expand_relations(relations):
+    """Return the given relations as a list of endpoint pairs.
+
+    Version 3 bundles allow relating an endpoint to many others at once,
+    e.g. ['mysql', ['wordpress', 'mediawiki']]: each endpoint of the first
+    entry is related to each endpoint of the other ones. Peer relations,
+    with a single endpoint, are kept as they are. Duplicate relations are
+    dropped, regardless of the order of their endpoints.
+    """
+    expanded = []
+    for relation in relations:
+        if not relation:
+            continue
+        firsts = _endpoints(relation[0])
+        others = _endpoints(relation[1:])
+        if others:
+            expanded.extend(
+                [first, other] for first in firsts for other in others)
+        else:
+            expanded.extend([first] for first in firsts)
+    return _combine_relations([], expanded)
+
+
+def _merge(base, override, top=False):
+    """Return a new dict holding base recursively updated with override.
+
+    Values not overridden are shared with base, and neither dict is
+    modified. At the top level, relations are combined rather than replaced.
+    """
+    result = dict(base)
+    for key, value in override.items():
+        current = result.get(key)
+        if top and key == 'relations' and current is not None:
+            result[key] = _combine_relations(current, value)
+        elif isinstance(current, dict) and isinstance(value, dict):
+            result[key] = _merge(current, value)
+        else:
+            result[key] = value
+    return result
+
+
+def _parents(bundle):
+    """Return the list of bundle names the given bundle inherits from."""
+    parents = bundle.get('inherits', [])
+    if not isinstance(parents, (list, tuple)):
+        parents = [parents]
+    return parents
+
+
+class Flattener(object):
+    """Resolve inheritance between the bundles in a version 3 bundle file.
+
+    Resolved bundles are memoized, so that ancestors shared by many bundles
+    are only merged once.
+    """
+
+    def __init__(self, bundles):
+        self.bundles = bundles
+        self._resolved = {}
+
+    def _combine(self, name):
+        """Return the named bundle merged with its already resolved parents.
+        """
+        bundle = self.bundles[name]
+        own = dict(
+            (key, value) for key, value in bundle.items() if key != 'inherits')
+        if 'relations' in own:
+            own['relations'] = _expand_relations(own['relations'])
+        parents = _parents(bundle)
+        if not parents:
+            return own
+        result = self._resolved[parents[0]]
+        for parent in parents[1:]:
+            result = _merge(result, self._resolved[parent], top=True)
+        if own:
+            result = _merge(result, own, top=True)
+        return result
+
+    def resolve(self, name):
+        """Return the flattened bundle with the given name.
+
+        Raise a ValueError if the bundle is unknown or if its inheritance
+        chain contains a cycle.
+        """
+        if name not in self.bundles:
+            raise ValueError('unknown bundle: {}'.format(name))
+        resolved = self._resolved
+        # Use an explicit stack so that deep inheritance chains do not hit
+        # the recursion limit.
+        in_progress = set()
+        stack = [(name, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if current in resolved:
+                continue
+            if expanded:
+                resolved[current] = self._combine(current)
+                in_progress.discard(current)
+                continue
+            if current in in_progress:
+                raise ValueError(
+                    'inheritance cycle involving bundle {}'.format(current))
+            in_progress.add(current)
+            stack.append((current, True))
+            for parent in reversed(_parents(self.bundles[current])):
+                if parent not in self.bundles:
+                    raise ValueError(
+                        'bundle {} inherits from unknown bundle {}'.format(
+                            current, parent))
+                if parent in in_progress:
+                    raise ValueError(
+                        'inheritance cycle involving bundle {}'.format(
+                            parent))
+                stack.append((parent, False))
+        return resolved[name]
+
+    def resolve_all(self):
+        """Return an ordered dict mapping bundle names to flattened bundles.
+        """
+        return OrderedDict(
+            (name, self.resolve(name)) for name in self.bundles)
+
+
+def flatten(bundles, name=None):
+    """Return the flattened bundles from a version 3 bundle file.
+
+    If a name is provided, return only that bundle, otherwise return an
+    ordered dict mapping all bundle names to their flattened bundles.
+    """
+    flattener = Flattener(bundles)
+    if name is not None:
+        return flattener.resolve(name)
+    return flattener.resolve_all()
+
+
+def parse_bundles(bundles):
+    """Return a generator yielding (name, changes) pairs.
+
+    Each bundle in the given version 3 bundle file is flattened, and changes
+    is the generator returned by parse.parse() for the flattened bundle.
+    """
+    for name, bundle in flatten(bundles).items():
+        yield name, parse.parse(bundle)
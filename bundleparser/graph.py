@@ -0,0 +1,213 @@
+"""Split a bundle into independent deployment partitions.
+
+Services are connected when they are related, or when their units are
+placed on the same machine or alongside each other. Each connected
+component of services (and the machines they use) can be deployed or
+checked on its own, without waiting for the others.
+"""
+
+from collections import OrderedDict
+
+from . import parse
+
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+
+class UnionFind(object):
+    """A disjoint-set forest over the integers 0 to size - 1.
+
+    Use union by size and path halving, so that any sequence of operations
+    runs in near-linear time.
+    """
+
+    def __init__(self, size):
+        self._parents = list(range(size))
+        self._sizes = [1] * size
+
+    def find(self, item):
+        """Return the representative of the set holding item."""
+        parents = self._parents
+        while parents[item] != item:
+            parents[item] = parents[parents[item]]
+            item = parents[item]
+        return item
+
+    def union(self, first, second):
+        """Merge the sets holding first and second."""
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return
+        if self._sizes[first] < self._sizes[second]:
+            first, second = second, first
+        self._parents[second] = first
+        self._sizes[first] += self._sizes[second]
+
+
+def _endpoints(relation):
+    """Return a generator yielding the service names in a relation.
+
+    Relation endpoints are "service:relation" or "service" strings, possibly
+    nested in lists as allowed by bundles version 3.
+    """
+    for endpoint in relation:
+        if isinstance(endpoint, _string_types):
+            yield endpoint.split(':')[0]
+        else:
+            for name in _endpoints(endpoint):
+                yield name
+
+
+def _placements(service):
+    """Return the list of placement directives for the given service."""
+    directives = service.get('to', [])
+    if isinstance(directives, _string_types):
+        directives = [directives]
+    return directives
+
+
+def components(bundle):
+    """Return the independent components of the given bundle.
+
+    The result is a list of (service names, machine names) tuples. Components
+    are ordered by their first service in the bundle, and names are listed in
+    the bundle order. Machines no service is placed on form components with
+    no services, listed last.
+    """
+    services = bundle.get('services', {})
+    machines = bundle.get('machines', {})
+    service_names = list(services)
+    machine_names = list(machines)
+    indexes = dict((name, i) for i, name in enumerate(service_names))
+    offset = len(service_names)
+    machine_indexes = dict(
+        (str(name), offset + i) for i, name in enumerate(machine_names))
+    forest = UnionFind(offset + len(machine_names))
+
+    for relation in bundle.get('relations', []):
+        endpoints = [indexes[name] for name in _endpoints(relation)]
+        for endpoint in endpoints[1:]:
+            forest.union(endpoints[0], endpoint)
+
+    is_v4 = 'machines' in bundle
+    parse_placement = parse.unit_placement_parser(bundle)
+    for name in service_names:
+        for directive in _placements(services[name]):
+            placement = parse_placement(directive)
+            if is_v4 and placement.machine in machine_indexes:
+                forest.union(indexes[name], machine_indexes[placement.machine])
+            elif placement.service in indexes:
+                forest.union(indexes[name], indexes[placement.service])
+
+    groups, order = {}, []
+    for i, name in enumerate(service_names + machine_names):
+        root = forest.find(i)
+        group = groups.get(root)
+        if group is None:
+            group = groups[root] = ([], [])
+            order.append(root)
+        group[0 if i < offset else 1].append(name)
+    return [groups[root] for root in order]
+
+
+def partition(bundle):
+    """Return a list of sub-bundles, one for each component of the bundle.
+
+    Each sub-bundle holds the services, machines and relations of a
+    component, and shares all other values with the given bundle.
+    """
+    relations = bundle.get('relations', [])
+    services = bundle.get('services', {})
+    machines = bundle.get('machines', {})
+    bundles = []
+    for service_names, machine_names in components(bundle):
+        names = set(service_names)
+        sub_bundle = dict(bundle)
+        sub_bundle['services'] = OrderedDict(
+            (name, services[name]) for name in service_names)
+        sub_bundle['relations'] = [
+            relation for relation in relations
+            if next(_endpoints(relation), None) in names]
+        if 'machines' in bundle:
+            sub_bundle['machines'] = OrderedDict(
+                (name, machines[name]) for name in machine_names)
+        bundles.append(sub_bundle)
+    return bundles
+
+
+def _references(change):
+    """Return a generator yielding the ids of the changes change refers to.
+
+    These are the changes it requires, followed by the ones its arguments
+    refer to as "$<id>" placeholders. Units not placed on a machine, for
+    instance, only refer to their service in their arguments.
+    """
+    for change_id in change['requires']:
+        yield change_id
+    stack = list(change['args'])
+    while stack:
+        value = stack.pop()
+        if isinstance(value, _string_types):
+            if value.startswith('$'):
+                yield value[1:]
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+
+
+def parse_partitions(bundle, canonical=False, pipeline=None, profile=None):
+    """Return a list of change lists, one for each bundle partition.
+
+    The bundle is parsed once, and each change is assigned to the component
+    of the services and machines it adds or requires, so that change ids are
+    the ones produced by parse.parse(). Changes required by several
+    partitions, like charms shared by services in different components, are
+    included in each of them. Changes for different partitions do not depend
+    on each other. Changes which cannot be assigned to any component are
+    included in the first partition, which is the only one if the bundle
+    has no services or machines. The other arguments have the same
+    meaning as for parse.parse().
+    """
+    changeset = parse.ChangeSet(bundle, canonical=canonical)
+    if pipeline is None:
+        pipeline = parse.registry.compile()
+    changes = list(pipeline.changes(changeset, profile))
+    groups = components(bundle)
+    owners = {}
+    for index, (service_names, machine_names) in enumerate(groups):
+        for name in service_names:
+            owners[changeset.services_added[name]] = index
+        for name in machine_names:
+            owners[changeset.machines_added[str(name)]] = index
+    by_id = dict((change['id'], change) for change in changes)
+    members = [set() for _ in groups]
+    for change in changes:
+        index = owners.get(change['id'])
+        if index is None:
+            index = next((owners[change_id]
+                          for change_id in _references(change)
+                          if change_id in owners), None)
+            if index is None:
+                continue
+            owners[change['id']] = index
+        # Add the change along with everything it requires, directly or not.
+        stack = [change['id']]
+        while stack:
+            change_id = stack.pop()
+            if change_id not in members[index]:
+                members[index].add(change_id)
+                stack.extend(by_id[change_id]['requires'])
+    # Changes unrelated to any service or machine, e.g. produced by custom
+    # stages, are kept in the first partition, created if the bundle has no
+    # services or machines.
+    assigned = set().union(*members)
+    unassigned = [change['id'] for change in changes
+                  if change['id'] not in assigned]
+    if unassigned:
+        if not members:
+            members.append(set())
+        members[0].update(unassigned)
+    return [[change for change in changes if change['id'] in ids]
+            for ids in members]
@@ -0,0 +1,67 @@
+"""Share service option blobs between deploy changes.
+
+Services often carry the same large options dict (config files,
+certificates). Instead of repeating the dict in every deploy change, the
+shared output mode stores each distinct dict once in a side table, keyed by
+the hash of its canonical JSON encoding, and deploy changes refer to it by
+key.
+"""
+
+
+# The position of the options dict in the deploy change arguments.
+OPTIONS_ARG = 2
+
+
+def options_key(options):
+    """Return the side table key for the given options dict.
+
+    Equal dicts always produce the same key, regardless of their ordering.
+    """
+    # Imported here so that importing this module stays cheap.
+    import hashlib
+    import json
+    encoded = json.dumps(options, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def share_options(changes, table):
+    """Return a generator yielding changes referring to shared options.
+
+    Non-empty options dicts in deploy changes are stored in the given table
+    dict and replaced by their key. The table is populated while the
+    generator is consumed. The given changes are not modified.
+    """
+    # Map the identity of already hashed dicts to (dict, key) pairs, so that
+    # the same dict object (e.g. a YAML alias) is only encoded once. The dict
+    # is stored as well so that its identity cannot be reused.
+    hashed = {}
+    for change in changes:
+        if change['method'] == 'deploy':
+            options = change['args'][OPTIONS_ARG]
+            if options:
+                try:
+                    key = hashed[id(options)][1]
+                except KeyError:
+                    key = options_key(options)
+                    hashed[id(options)] = (options, key)
+                    table.setdefault(key, options)
+                args = list(change['args'])
+                args[OPTIONS_ARG] = key
+                change = dict(change, args=args)
+        yield change
+
+
+def expand_options(changes, table):
+    """Return a generator yielding the full changes.
+
+    This is the reverse of share_options: option keys in deploy changes are
+    replaced by the corresponding dicts found in table.
+    """
+    for change in changes:
+        if change['method'] == 'deploy':
+            key = change['args'][OPTIONS_ARG]
+            if not isinstance(key, dict):
+                args = list(change['args'])
+                args[OPTIONS_ARG] = table[key]
+                change = dict(change, args=args)
+        yield change
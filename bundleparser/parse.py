@@ -1,6 +1,24 @@
 import itertools
+import time
+import warnings
 
-from collections import namedtuple
+from collections import (
+    namedtuple,
+    OrderedDict,
+)
+
+from .constraints import (
+    constraints_key,
+    parse_constraints,
+)
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+# Use the most precise clock available to profile handlers.
+_timer = getattr(time, 'perf_counter', time.time)
 
 
 # Define a tuple holding a specific unit placement.
@@ -44,18 +62,67 @@ def _parse_v4_unit_placement(placement):
     return UnitPlacement(container, machine, service, unit)
 
 
+def unit_placement_parser(bundle):
+    """Return the function parsing the unit placements of the given bundle.
+
+    The function takes a placement string and returns a UnitPlacement.
+    Bundles version 4, which have a machines section, refer to units as
+    "service/unit", and bundles version 3 as "service=unit".
+    """
+    if 'machines' in bundle:
+        return _parse_v4_unit_placement
+    return _parse_v3_unit_placement
+
+
+def _machine_sort_key(name):
+    """Return the key used to sort machine names in canonical order.
+
+    Numeric names, either integers or strings, are sorted numerically and
+    come before any other name.
+    """
+    name = str(name)
+    if name.isdigit():
+        return (0, int(name), name)
+    return (1, 0, name)
+
+
 class ChangeSet(object):
     """Hold the state for parser handlers.
 
     Also expose methods to send and receive changes (usually Python dicts).
+
+    If canonical is True, services and machines are iterated in sorted order
+    rather than in the bundle dicts order, so that equal bundles always
+    produce the same changes with the same ids. The order is computed once,
+    when the change set is created.
     """
-    services_added = {}
-    machines_added = {}
 
-    def __init__(self, bundle):
+    def __init__(self, bundle, canonical=False):
         self.bundle = bundle
+        self.services_added = {}
+        self.machines_added = {}
         self._changeset = []
         self._counter = itertools.count()
+        services = bundle.get('services', {})
+        machines = bundle.get('machines', {})
+        if canonical:
+            self.service_names = sorted(services, key=str)
+            self.machine_names = sorted(machines, key=_machine_sort_key)
+        else:
+            self.service_names = list(services)
+            self.machine_names = list(machines)
+
+    def services(self):
+        """Return a generator yielding (name, service) pairs in order."""
+        services = self.bundle['services']
+        for name in self.service_names:
+            yield name, services[name]
+
+    def machines(self):
+        """Return a generator yielding (name, machine) pairs in order."""
+        machines = self.bundle.get('machines', {})
+        for name in self.machine_names:
+            yield name, machines[name]
 
     def send(self, change):
         """Store a change in this change set."""
@@ -72,29 +139,319 @@ class ChangeSet(object):
 
     def next_action(self):
         """Return an incremental integer to be included in the changes ids."""
-        return self._counter.next()
+        return next(self._counter)
 
 
-def parse(bundle, handler=None):
-    """Return a generator yielding changes required to deploy the given bundle.
+class _ConsumerClosed(BaseException):
+    """Raised in the producer thread when the consumer stopped receiving
+    changes.
 
-    The bundle argument is a YAML decoded Python dict.
+    It derives from BaseException so that handlers catching Exception do
+    not swallow it.
     """
-    changeset = ChangeSet(bundle)
-    if handler is None:
-        handler = handle_services
-    while True:
-        handler = handler(changeset)
+
+
+class BufferedChangeSet(ChangeSet):
+    """A change set handing changes to a consumer through a bounded buffer.
+
+    Handlers run in a producer thread: send() blocks while the buffer is
+    full, so that a slow consumer throttles the handlers, and at most
+    buffer_size changes are held at any time.
+    """
+
+    # Seconds to wait on a full buffer before checking whether the consumer
+    # has gone away.
+    poll_interval = 0.1
+
+    def __init__(self, bundle, buffer_size, canonical=False):
+        # Imported here so that importing this module stays cheap.
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        super(BufferedChangeSet, self).__init__(bundle, canonical=canonical)
+        self._queue = queue.Queue(buffer_size)
+        self._full = queue.Full
+        self.closed = False
+
+    def send(self, change):
+        """Add a change to the buffer, waiting for a free slot if required.
+
+        Raise a _ConsumerClosed if the consumer stopped receiving changes.
+        """
+        while not self.closed:
+            try:
+                self._queue.put(change, timeout=self.poll_interval)
+                return
+            except self._full:
+                pass
+        raise _ConsumerClosed()
+
+    def get(self):
+        """Return the next change from the buffer, waiting if required.
+
+        Unlike recv(), which returns all the changes sent so far, return a
+        single change.
+        """
+        return self._queue.get()
+
+
+class _End(object):
+    """Mark the end of the changes sent to a BufferedChangeSet.
+
+    The error attribute holds the exception raised by a handler, if any.
+    """
+
+    __slots__ = ('error',)
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+def _produce(changeset, steps):
+    """Run the handlers, sending their changes to the buffered change set.
+
+    The end of the changes, or any error raised by a handler, is sent last.
+    Errors include exceptions like SystemExit, so that the consumer never
+    waits forever for the end of the changes.
+    """
+    try:
+        for _ in steps:
+            pass
+    except _ConsumerClosed:
+        return
+    except BaseException as err:
+        end = _End(err)
+    else:
+        end = _End()
+    try:
+        changeset.send(end)
+    except _ConsumerClosed:
+        pass
+
+
+def _parse_buffered(changeset, steps):
+    """Yield the changes produced by the handlers run in another thread."""
+    import threading
+    producer = threading.Thread(target=_produce, args=(changeset, steps))
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            change = changeset.get()
+            if isinstance(change, _End):
+                if change.error is not None:
+                    raise change.error
+                break
+            yield change
+    finally:
+        changeset.closed = True
+        producer.join()
+
+
+def _parse(changeset, steps):
+    """Yield the changes produced by each handler once it returns."""
+    for _ in steps:
         for change in changeset.recv():
             yield change
-        if handler is None:
-            break
+
+
+def _record(profile, name, elapsed):
+    """Add the elapsed time to the profile entry with the given name."""
+    profile[name] = profile.get(name, 0) + elapsed
+
+
+def _chain_steps(changeset, handler, profile=None):
+    """Run the chain of handlers starting with handler.
+
+    Each handler returns the next one to run, or None. Yield after each
+    handler runs. This supports the deprecated handler argument of parse().
+    Built-in handlers do not return the next one: when the chain reaches a
+    handler registered on the module registry, the registry pipeline is run
+    from that stage to the end.
+    """
+    while handler is not None:
+        stages = registry.compile().stages
+        for position, stage in enumerate(stages):
+            if stage.handler is handler:
+                pipeline = Pipeline(stages[position:])
+                for _ in pipeline.steps(changeset, profile):
+                    yield
+                return
+        name = handler.__name__
+        start = _timer()
+        handler = handler(changeset)
+        if profile is not None:
+            _record(profile, name, _timer() - start)
+        yield
+
+
+# Define a tuple holding a handler and the change set indexes it uses.
+Stage = namedtuple('Stage', ['name', 'handler', 'inputs', 'outputs'])
+
+
+class Pipeline(object):
+    """A compiled, fixed sequence of stages.
+
+    Pipelines are created by HandlerRegistry.compile().
+    """
+
+    def __init__(self, stages):
+        self.stages = tuple(stages)
+
+    def steps(self, changeset, profile=None):
+        """Run the stages on the given change set, yielding after each one.
+
+        Before a stage runs, each of its declared outputs is set to an empty
+        index dict on the change set, to be filled by the stage and read by
+        the following stages declaring it as an input. The return values of
+        the handlers are ignored.
+        If a profile dict is provided, the time spent in each stage, in
+        seconds, is added to the entry named after the stage.
+        """
+        for name, handler, _, outputs in self.stages:
+            for output in outputs:
+                setattr(changeset, output, {})
+            start = _timer()
+            handler(changeset)
+            if profile is not None:
+                _record(profile, name, _timer() - start)
+            yield
+
+    def changes(self, changeset, profile=None):
+        """Return a generator yielding the changes produced by the stages.
+
+        Changes are sent to the given change set, which can be inspected
+        once the generator is exhausted, e.g. to map service names to the
+        ids of their deploy changes. See steps() for the profile argument.
+        """
+        return _parse(changeset, self.steps(changeset, profile))
+
+
+class HandlerRegistry(object):
+    """Hold the stages producing changes, and compile them into a pipeline.
+
+    Each stage is a handler, called with the change set, which declares the
+    names of the change set indexes (dicts such as services_added) it reads
+    (its inputs) and fills (its outputs). Stages are run in registration
+    order, except that a stage always runs after the stages producing its
+    inputs.
+    """
+
+    def __init__(self):
+        self._stages = []
+        self._pipeline = None
+
+    def register(self, name, handler, inputs=(), outputs=()):
+        """Register a stage with the given name.
+
+        Raise a ValueError if a stage with the same name already exists.
+        """
+        if name in self.names():
+            raise ValueError('stage already registered: {}'.format(name))
+        self._stages.append(
+            Stage(name, handler, tuple(inputs), tuple(outputs)))
+        self._pipeline = None
+
+    def unregister(self, name):
+        """Remove the stage with the given name."""
+        stages = [stage for stage in self._stages if stage.name != name]
+        if len(stages) == len(self._stages):
+            raise ValueError('unknown stage: {}'.format(name))
+        self._stages = stages
+        self._pipeline = None
+
+    def names(self):
+        """Return the names of the registered stages, in registration order.
+        """
+        return [stage.name for stage in self._stages]
+
+    def compile(self):
+        """Return the Pipeline running the registered stages.
+
+        The pipeline is cached until the registry changes. Raise a ValueError
+        if an input is not produced by any stage, if an output is produced
+        by more than one stage, or if stages depend on each other in a cycle.
+        """
+        if self._pipeline is not None:
+            return self._pipeline
+        producers = {}
+        for stage in self._stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(
+                        'index {} produced by both {} and {}'.format(
+                            output, producers[output].name, stage.name))
+                producers[output] = stage
+        for stage in self._stages:
+            for name in stage.inputs:
+                if name not in producers:
+                    raise ValueError('index {} required by {} not produced '
+                                     'by any stage'.format(name, stage.name))
+        ordered, done = [], set()
+        pending = list(self._stages)
+        while pending:
+            # Pick the first stage in registration order whose inputs are
+            # all available.
+            for position, stage in enumerate(pending):
+                if all(producers[name].name in done for name in stage.inputs):
+                    break
+            else:
+                raise ValueError(
+                    'cyclic dependencies between stages: {}'.format(
+                        ', '.join(stage.name for stage in pending)))
+            del pending[position]
+            ordered.append(stage)
+            done.add(stage.name)
+        self._pipeline = Pipeline(ordered)
+        return self._pipeline
+
+
+def parse(bundle, handler=None, canonical=False, buffer_size=None,
+          pipeline=None, profile=None):
+    """Return a generator yielding changes required to deploy the given bundle.
+
+    The bundle argument is a YAML decoded Python dict.
+    By default, changes are produced by the pipeline compiled from the
+    module registry. Another Pipeline can be provided.
+    The handler argument is deprecated: it starts a chain of handlers, each
+    one returning the next one to run. Built-in handlers do not return the
+    next one, as their order is defined by the registry: reaching one of
+    them runs the rest of the default pipeline from its stage.
+    If canonical is True, changes do not depend on the order of the services
+    and machines in the bundle dicts. See ChangeSet.
+    If buffer_size is provided, handlers run in a separate thread and never
+    get more than buffer_size changes ahead of the consumer, so that memory
+    usage does not depend on the bundle size. See BufferedChangeSet.
+    If a profile dict is provided, the time spent in each stage or handler
+    is added to it, in seconds. In buffered mode, this includes the time
+    spent waiting for the consumer.
+    """
+    if buffer_size is not None:
+        if buffer_size < 1:
+            raise ValueError('invalid buffer size: {}'.format(buffer_size))
+        changeset = BufferedChangeSet(
+            bundle, buffer_size, canonical=canonical)
+    else:
+        changeset = ChangeSet(bundle, canonical=canonical)
+    if handler is not None:
+        warnings.warn(
+            'the handler argument is deprecated, use a pipeline instead',
+            DeprecationWarning, stacklevel=2)
+        steps = _chain_steps(changeset, handler, profile)
+    else:
+        if pipeline is None:
+            pipeline = registry.compile()
+        steps = pipeline.steps(changeset, profile)
+    if buffer_size is not None:
+        return _parse_buffered(changeset, steps)
+    return _parse(changeset, steps)
 
 
 def handle_services(changeset):
     """Populate the change set with addCharm and addService changes."""
     charms = {}
-    for service_name, service in changeset.bundle['services'].items():
+    for service_name, service in changeset.services():
         # Add the addCharm record if one hasn't been added yet.
         if service['charm'] not in charms:
             record_id = 'addCharm-{}'.format(changeset.next_action())
@@ -119,23 +476,43 @@ def handle_services(changeset):
             'requires': [charms[service['charm']]],
         })
         changeset.services_added[service_name] = record_id
-    return handle_machines
 
 
 def handle_machines(changeset):
     """Populate the change set with addMachine changes."""
-    for machine_name, machine in changeset.bundle.get('machines', {}).items():
+    for machine_name, machine in changeset.machines():
         record_id = 'addMachine-{}'.format(changeset.next_action())
         changeset.send({
             'id': record_id,
             'method': 'addMachine',
             'args': [
                 machine.get('series', ''),
-                machine.get('constraints', {})],
+                parse_constraints(machine.get('constraints', {}))],
             'requires': [],
         })
-        changeset.machines_added[machine_name] = record_id
-    return handle_relations
+        # Machine names are often decoded as integers by YAML, while
+        # placement directives refer to them as strings.
+        changeset.machines_added[str(machine_name)] = record_id
+
+
+def group_machines(changes):
+    """Return the addMachine change ids grouped by identical machine specs.
+
+    The result is a list of (series, constraints, ids) tuples, in the order
+    each spec first appears in changes, so that a deployer can add all the
+    machines in a group with a single bulk request.
+    """
+    groups = OrderedDict()
+    for change in changes:
+        if change['method'] != 'addMachine':
+            continue
+        series, constraints = change['args']
+        key = (series, constraints_key(constraints))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = (series, constraints, [])
+        group[2].append(change['id'])
+    return list(groups.values())
 
 
 def handle_relations(changeset):
@@ -154,54 +531,51 @@ def handle_relations(changeset):
             'requires': [changeset.services_added[rel_name.split(':')[0]] for
                          rel_name in relation],
         })
-    return handle_units
 
 
 def handle_units(changeset):
-    """Populate the change set with addUnit changes."""
-    units, records = {}, {}
-    for service_name, service in changeset.bundle['services'].items():
+    """Populate the change set with addUnit changes.
+
+    Records are built and sent one at a time. Their ids are assigned in the
+    same order they are sent, so no record needs to be held back.
+    """
+    has_machines = 'machines' in changeset.bundle
+    for service_name, service in changeset.services():
+        placement_directives = service.get('to', [])
+        if isinstance(placement_directives, _string_types):
+            placement_directives = [placement_directives]
+        # In bundles version 4 the last placement directive applies to all
+        # the remaining units.
+        last = len(placement_directives) - 1
+        service_id = '${}'.format(changeset.services_added[service_name])
         for i in range(service['num_units']):
-            record_id = 'addUnit-{}'.format(changeset.next_action())
-            unit_name = '{}/{}'.format(service_name, i)
-            records[record_id] = {
-                'id': record_id,
+            record = {
+                'id': 'addUnit-{}'.format(changeset.next_action()),
                 'method': 'addUnit',
-                'args': [
-                    '${}'.format(changeset.services_added[service_name]),
-                    1,
-                    None,
-                ],
+                'args': [service_id, 1, None],
                 'requires': [],
             }
-            units[unit_name] = {
-                'record': record_id,
-                'service': service_name,
-                'unit': i,
-            }
-    # Second pass, ensure that requires and placement directives are taken into
-    # account.
-    for service_name, service in changeset.bundle['services'].items():
-        # Add the addUnits record for each unit.
-        placement_directives = service.get('to', [])
-        if isinstance(placement_directives, basestring):
-            placement_directives = [placement_directives]
-        if placement_directives and 'machines' in changeset.bundle:
-            placement_directives += placement_directives[-1:] * \
-                (service['num_units'] - len(placement_directives))
-        for i in range(service['num_units']):
-            unit = units['{}/{}'.format(service_name, i)]
-            record = records[unit['record']]
-            if i < len(placement_directives):
-                if 'machines' in changeset.bundle:
+            if has_machines:
+                if last >= 0:
                     placement = _parse_v4_unit_placement(
-                        placement_directives[i])
-                    if placement['machine']:
+                        placement_directives[min(i, last)])
+                    if placement.machine:
                         machine_id = changeset.machines_added[
-                            placement['machine']]
+                            placement.machine]
                         record['requires'].append(machine_id)
                         record['args'][2] = '${}'.format(machine_id)
-                else:
-                    placement = _parse_v3_unit_placement(
-                        placement_directives[i])
+            elif i <= last:
+                placement = _parse_v3_unit_placement(placement_directives[i])
             changeset.send(record)
+
+
+# The registry holding the stages run by default by parse().
+registry = HandlerRegistry()
+registry.register(
+    'services', handle_services, outputs=['services_added'])
+registry.register(
+    'machines', handle_machines, outputs=['machines_added'])
+registry.register(
+    'relations', handle_relations, inputs=['services_added'])
+registry.register(
+    'units', handle_units, inputs=['services_added', 'machines_added'])
@@ -1,2 +1,12 @@
+from .constraints import parse_constraints
+
+
 def validate_bundle(bundle):
-    return []
+    """Return a list of error messages for the given bundle."""
+    errors = []
+    for machine_name, machine in bundle.get('machines', {}).items():
+        try:
+            parse_constraints(machine.get('constraints', {}), strict=True)
+        except ValueError as err:
+            errors.append('machine {}: {}'.format(machine_name, err))
+    return errors
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+
+"""
+fuzz
+----------------------------------
+
+A differential testing harness for bundle parsers.
+
+Random valid bundles of many shapes and sizes are generated and given to a
+reference parser and a candidate parser, both being callables taking a
+bundle and returning an iterable of changes. Change sets are compared after
+normalization, failing bundles are shrunk to a minimal failing bundle, and
+the throughput ratio of the two parsers is recorded for each case.
+
+Run `python -m tests.fuzz` to compare the reference implementation with
+the default `parse.parse` code path on a larger number of cases.
+"""
+
+from __future__ import print_function
+
+from collections import (
+    namedtuple,
+    OrderedDict,
+)
+import copy
+import json
+import random
+import time
+
+from bundleparser import parse
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+# Use the most precise clock available to time parsers.
+timer = getattr(time, 'perf_counter', time.time)
+
+SERIES = ('precise', 'trusty', 'vivid', 'xenial')
+CONSTRAINTS = (
+    '', 'mem=4G', 'mem=4096M cores=2', 'arch=amd64 root-disk=20G',
+    'mem=1.5g tags=web,db', 'cpu-power=100 allocate-public-ip=true',
+    {'cpu-cores': 4}, {'mem': '2G', 'tags': ['web']}, {'root-disk': 1.5},
+    {'image-id': 'ami-1', 'spaces': 'public'},
+)
+CONTAINERS = ('lxc', 'kvm')
+
+# The outcome of a single case: the seed and size used to generate the
+# bundle, whether both parsers agree, the shrunk bundle if they do not, and
+# the reference time divided by the candidate time (above 1 when the
+# candidate is faster).
+Result = namedtuple('Result', ['seed', 'size', 'ok', 'bundle', 'ratio'])
+
+
+def generate_bundle(rnd, size):
+    """Return a random valid bundle.
+
+    The rnd argument is a random.Random instance, and size roughly controls
+    the number of services, machines, units and relations.
+    """
+    v4 = rnd.random() < 0.6
+    services = OrderedDict()
+    service_names = ['service-{}'.format(i)
+                     for i in range(1, rnd.randint(1, size) + 1)]
+    rnd.shuffle(service_names)
+    charms = ['cs:{}/charm-{}'.format(rnd.choice(SERIES), i)
+              for i in range(rnd.randint(1, len(service_names)))]
+    bundle = {'series': rnd.choice(SERIES), 'services': services}
+    machine_names = []
+    if v4:
+        machines = OrderedDict()
+        for i in rnd.sample(range(size * 2), rnd.randint(0, size)):
+            name = i if rnd.random() < 0.5 else str(i)
+            machine = {}
+            if rnd.random() < 0.5:
+                machine['series'] = rnd.choice(SERIES)
+            if rnd.random() < 0.5:
+                machine['constraints'] = copy.deepcopy(
+                    rnd.choice(CONSTRAINTS))
+            machines[name] = machine
+            machine_names.append(str(name))
+        bundle['machines'] = machines
+    for position, name in enumerate(service_names):
+        service = {
+            'charm': rnd.choice(charms),
+            'num_units': rnd.randint(0, size),
+        }
+        if rnd.random() < 0.3:
+            service['options'] = dict(
+                ('key{}'.format(i), rnd.choice([i, 'value', True, 1.5]))
+                for i in range(rnd.randint(0, 4)))
+        directives = [
+            _placement(rnd, v4, machine_names, service_names[:position])
+            for _ in range(rnd.randint(0, service['num_units'] + 1))]
+        directives = [directive for directive in directives if directive]
+        if directives:
+            if len(directives) == 1 and rnd.random() < 0.5:
+                directives = directives[0]
+            service['to'] = directives
+        services[name] = service
+    bundle['relations'] = [
+        ['{}:rel{}'.format(rnd.choice(service_names), i),
+         '{}:rel{}'.format(rnd.choice(service_names), i)]
+        for i in range(rnd.randint(0, size))]
+    return bundle
+
+
+def _placement(rnd, v4, machine_names, service_names):
+    """Return a random placement directive, or None if none is possible."""
+    choices = []
+    if v4 and machine_names:
+        choices.append(rnd.choice(machine_names))
+    if service_names:
+        target = rnd.choice(service_names)
+        unit = str(rnd.randint(0, 3))
+        choices.append(target)
+        choices.append(target + ('/' if v4 else '=') + unit)
+    if not v4:
+        choices.append('0')
+    if not choices:
+        return None
+    directive = rnd.choice(choices)
+    if rnd.random() < 0.3:
+        directive = '{}:{}'.format(rnd.choice(CONTAINERS), directive)
+    return directive
+
+
+def _rename(value, ids):
+    """Return value with the change ids it references renamed using ids."""
+    if isinstance(value, string_types):
+        if value in ids:
+            return ids[value]
+        if value.startswith('$') and value[1:] in ids:
+            return '$' + ids[value[1:]]
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_rename(item, ids) for item in value]
+    if isinstance(value, dict):
+        return dict((key, _rename(item, ids)) for key, item in value.items())
+    return value
+
+
+def normalize(changes):
+    """Return the given changes in a form suitable for comparisons.
+
+    Change ids are renumbered in order of appearance, so that they do not
+    depend on how a parser counts, tuples become lists and dicts become
+    canonical JSON strings.
+    """
+    changes = list(changes)
+    ids = {}
+    for num, change in enumerate(changes):
+        prefix = change['id'].rpartition('-')[0]
+        ids[change['id']] = '{}-{}'.format(prefix, num)
+    return [json.dumps(_rename(change, ids), sort_keys=True)
+            for change in changes]
+
+
+def _run(parser, bundle):
+    """Return the normalized changes and the time taken by the parser.
+
+    If the parser raises an exception, return its type instead of changes.
+    """
+    bundle = copy.deepcopy(bundle)
+    start = timer()
+    try:
+        changes = list(parser(bundle))
+    except Exception as err:
+        return type(err), timer() - start
+    elapsed = timer() - start
+    return normalize(changes), elapsed
+
+
+def agree(reference, candidate, bundle):
+    """Return whether both parsers produce the same changes for bundle."""
+    return _run(reference, bundle)[0] == _run(candidate, bundle)[0]
+
+
+def _without_service(bundle, name):
+    """Return a copy of bundle without the given service and its uses."""
+    bundle = copy.deepcopy(bundle)
+    del bundle['services'][name]
+    bundle['relations'] = [
+        relation for relation in bundle.get('relations', [])
+        if name not in [endpoint.split(':')[0] for endpoint in relation]]
+    parse_placement = parse.unit_placement_parser(bundle)
+    for service in bundle['services'].values():
+        directives = service.get('to')
+        if directives is None:
+            continue
+        if isinstance(directives, string_types):
+            directives = [directives]
+        directives = [directive for directive in directives
+                      if parse_placement(directive).service != name]
+        if directives:
+            service['to'] = directives
+        else:
+            del service['to']
+    return bundle
+
+
+def _without_machine(bundle, name):
+    """Return a copy of bundle without the given machine and its uses."""
+    bundle = copy.deepcopy(bundle)
+    del bundle['machines'][name]
+    parse_placement = parse.unit_placement_parser(bundle)
+    for service in bundle['services'].values():
+        directives = service.get('to')
+        if directives is None:
+            continue
+        if isinstance(directives, string_types):
+            directives = [directives]
+        directives = [
+            directive for directive in directives
+            if parse_placement(directive).machine != str(name)]
+        if directives:
+            service['to'] = directives
+        else:
+            del service['to']
+    return bundle
+
+
+def _reductions(bundle):
+    """Yield smaller variants of the given bundle, biggest steps first."""
+    for name in list(bundle['services']):
+        yield _without_service(bundle, name)
+    for name in list(bundle.get('machines', {})):
+        yield _without_machine(bundle, name)
+    for i in range(len(bundle.get('relations', []))):
+        reduced = copy.deepcopy(bundle)
+        del reduced['relations'][i]
+        yield reduced
+    for name, service in bundle['services'].items():
+        for key in ('to', 'options'):
+            if key in service:
+                reduced = copy.deepcopy(bundle)
+                del reduced['services'][name][key]
+                yield reduced
+        if service['num_units']:
+            reduced = copy.deepcopy(bundle)
+            reduced['services'][name]['num_units'] -= 1
+            yield reduced
+    for name, machine in bundle.get('machines', {}).items():
+        if machine:
+            reduced = copy.deepcopy(bundle)
+            reduced['machines'][name] = {}
+            yield reduced
+
+
+def shrink(bundle, fails):
+    """Return a minimal bundle for which fails(bundle) is still True.
+
+    Reductions are applied greedily until none of them keeps the failure.
+    """
+    progress = True
+    while progress:
+        progress = False
+        for reduced in _reductions(bundle):
+            if fails(reduced):
+                bundle, progress = reduced, True
+                break
+    return bundle
+
+
+def run_case(reference, candidate, seed, size):
+    """Compare both parsers on the bundle generated from seed and size.
+
+    Return a Result.
+    """
+    bundle = generate_bundle(random.Random(seed), size)
+    expected, reference_time = _run(reference, bundle)
+    obtained, candidate_time = _run(candidate, bundle)
+    ratio = reference_time / candidate_time if candidate_time else 0
+    if expected == obtained:
+        return Result(seed, size, True, None, ratio)
+    minimal = shrink(
+        bundle, lambda bundle: not agree(reference, candidate, bundle))
+    return Result(seed, size, False, minimal, ratio)
+
+
+def fuzz(reference, candidate, cases=100, seed=0, sizes=(1, 3, 10, 30)):
+    """Run the given number of cases, cycling through sizes.
+
+    Return the list of Results.
+    """
+    return [
+        run_case(reference, candidate, seed + num, sizes[num % len(sizes)])
+        for num in range(cases)]
+
+
+def main():
+    from . import reference
+    results = fuzz(reference.parse, parse.parse, cases=400,
+                   sizes=(1, 3, 10, 30, 100))
+    failures = [result for result in results if not result.ok]
+    for size in sorted(set(result.size for result in results)):
+        ratios = sorted(
+            result.ratio for result in results if result.size == size)
+        print('size {:>3}: median throughput ratio {:.2f} '
+              '(min {:.2f}, max {:.2f})'.format(
+                  size, ratios[len(ratios) // 2], ratios[0], ratios[-1]))
+    for result in failures:
+        print('seed {} size {} failed, minimal bundle:'.format(
+            result.seed, result.size))
+        print(json.dumps(result.bundle, indent=4, sort_keys=True))
+    print('{} cases, {} failures'.format(len(results), len(failures)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+"""
+reference
+----------------------------------
+
+A straightforward reference implementation of `parse.parse`, used by the
+differential tests to check optimized code paths.
+
+It follows the original handler chain design: services and machines are
+iterated in dict order, and units are built in a first pass and sent in a
+second one. Keep it simple rather than fast, and independent from the
+bundleparser package.
+"""
+
+from collections import namedtuple
+import itertools
+import math
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+# Map size suffixes to their multiplier, in megabytes.
+SIZES = {'M': 1, 'G': 1024, 'T': 1024 ** 2, 'P': 1024 ** 3}
+
+
+def parse_constraints(constraints):
+    """Return the given valid constraints as a normalized dict.
+
+    Sizes are converted to megabytes, counts to integers and list-valued
+    constraints to lists of strings. Other constraints are kept unchanged.
+    """
+    if isinstance(constraints, string_types):
+        constraints = dict(item.split('=', 1) for item in constraints.split())
+    result = {}
+    for name, value in constraints.items():
+        if name in ('mem', 'root-disk'):
+            value = str(value)
+            multiplier = SIZES.get(value[-1:].upper(), 1)
+            if value[-1:].upper() in SIZES:
+                value = value[:-1]
+            value = int(math.ceil(float(value) * multiplier))
+        elif name in ('cores', 'cpu-cores', 'cpu-power'):
+            value = int(value)
+        elif name in ('spaces', 'tags', 'zones'):
+            if isinstance(value, string_types):
+                value = [item for item in value.split(',') if item]
+            value = [str(item) for item in value]
+        elif name in ('arch', 'container', 'instance-type', 'virt-type'):
+            value = str(value)
+        result[name] = value
+    return result
+
+
+UnitPlacement = namedtuple(
+    'UnitPlacement', ['container_type', 'machine', 'service', 'unit'])
+
+
+def parse_v3_unit_placement(placement):
+    container = machine = service = unit = ''
+    if ':' in placement:
+        container, placement = placement.split(':')
+    if '=' in placement:
+        placement, unit = placement.split('=')
+    if placement.isdigit():
+        machine = placement
+    else:
+        service = placement
+    return UnitPlacement(container, machine, service, unit)
+
+
+def parse_v4_unit_placement(placement):
+    container = machine = service = unit = ''
+    if ':' in placement:
+        container, placement = placement.split(':')
+    if '/' in placement:
+        placement, unit = placement.split('/')
+    if placement.isdigit():
+        machine = placement
+    else:
+        service = placement
+    return UnitPlacement(container, machine, service, unit)
+
+
+class ChangeSet(object):
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+        self.services_added = {}
+        self.machines_added = {}
+        self.changes = []
+        self.counter = itertools.count()
+
+    def send(self, change):
+        self.changes.append(change)
+
+    def next_action(self):
+        return next(self.counter)
+
+
+def parse(bundle):
+    """Return the list of changes required to deploy the given bundle."""
+    changeset = ChangeSet(bundle)
+    for handler in (
+            handle_services, handle_machines, handle_relations, handle_units):
+        handler(changeset)
+    return changeset.changes
+
+
+def handle_services(changeset):
+    charms = {}
+    for service_name, service in changeset.bundle['services'].items():
+        if service['charm'] not in charms:
+            record_id = 'addCharm-{}'.format(changeset.next_action())
+            changeset.send({
+                'id': record_id,
+                'method': 'addCharm',
+                'args': [service['charm']],
+                'requires': [],
+            })
+            charms[service['charm']] = record_id
+        record_id = 'addService-{}'.format(changeset.next_action())
+        changeset.send({
+            'id': record_id,
+            'method': 'deploy',
+            'args': [
+                service['charm'],
+                service_name,
+                service.get('options', {})
+            ],
+            'requires': [charms[service['charm']]],
+        })
+        changeset.services_added[service_name] = record_id
+
+
+def handle_machines(changeset):
+    for machine_name, machine in changeset.bundle.get('machines', {}).items():
+        record_id = 'addMachine-{}'.format(changeset.next_action())
+        changeset.send({
+            'id': record_id,
+            'method': 'addMachine',
+            'args': [
+                machine.get('series', ''),
+                parse_constraints(machine.get('constraints', {}))],
+            'requires': [],
+        })
+        changeset.machines_added[str(machine_name)] = record_id
+
+
+def handle_relations(changeset):
+    for relation in changeset.bundle.get('relations', []):
+        changeset.send({
+            'id': 'addRelation-{}'.format(changeset.next_action()),
+            'method': 'addRelation',
+            'args': [
+                [
+                    '${}'.format(
+                        changeset.services_added[rel_name.split(':')[0]]),
+                    {'name': rel_name.split(':')[0]},
+                ] for rel_name in relation
+            ],
+            'requires': [changeset.services_added[rel_name.split(':')[0]] for
+                         rel_name in relation],
+        })
+
+
+def handle_units(changeset):
+    units, records = {}, {}
+    for service_name, service in changeset.bundle['services'].items():
+        for i in range(service['num_units']):
+            record_id = 'addUnit-{}'.format(changeset.next_action())
+            records[record_id] = {
+                'id': record_id,
+                'method': 'addUnit',
+                'args': [
+                    '${}'.format(changeset.services_added[service_name]),
+                    1,
+                    None,
+                ],
+                'requires': [],
+            }
+            units['{}/{}'.format(service_name, i)] = record_id
+    for service_name, service in changeset.bundle['services'].items():
+        placement_directives = service.get('to', [])
+        if isinstance(placement_directives, string_types):
+            placement_directives = [placement_directives]
+        if placement_directives and 'machines' in changeset.bundle:
+            placement_directives = placement_directives + \
+                placement_directives[-1:] * \
+                (service['num_units'] - len(placement_directives))
+        for i in range(service['num_units']):
+            record = records[units['{}/{}'.format(service_name, i)]]
+            if i < len(placement_directives):
+                if 'machines' in changeset.bundle:
+                    placement = parse_v4_unit_placement(
+                        placement_directives[i])
+                    if placement.machine:
+                        machine_id = changeset.machines_added[
+                            placement.machine]
+                        record['requires'].append(machine_id)
+                        record['args'][2] = '${}'.format(machine_id)
+                else:
+                    placement = parse_v3_unit_placement(
+                        placement_directives[i])
+            changeset.send(record)
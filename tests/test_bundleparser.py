@@ -8,9 +8,21 @@ test_bundleparser
 Tests for `bundleparser` module.
 """
 
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 
-# from bundleparser import bundleparser
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from bundleparser import bundleparser
 
 
 class TestBundleparser(unittest.TestCase):
@@ -24,5 +36,120 @@ class TestBundleparser(unittest.TestCase):
     def tearDown(self):
         pass
 
+
+class TestLoadBundleFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def load(self, content, name='bundle.yaml'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        bundle, digest = bundleparser.load_bundle_file(path)
+        self.assertEqual(hashlib.sha256(content).hexdigest(), digest)
+        return bundle
+
+    def test_yaml(self):
+        self.assertEqual(
+            {'services': {'django': {'num_units': 1}}},
+            self.load(b'services:\n  django:\n    num_units: 1\n'))
+
+    def test_large_yaml(self):
+        content = ''.join(
+            'service-{}:\n  num_units: {}\n'.format(i, i)
+            for i in range(20000)).encode('ascii')
+        self.assertTrue(bundleparser.CHUNK_SIZE * 2 < len(content))
+        bundle = self.load(content)
+        self.assertEqual(20000, len(bundle))
+        self.assertEqual({'num_units': 19999}, bundle['service-19999'])
+
+    def test_json(self):
+        self.assertEqual(
+            {'services': {'django': {'num_units': 1}}},
+            self.load(b'  {"services": {"django": {"num_units": 1}}}'))
+
+    def test_json_extension(self):
+        self.assertEqual(
+            ['a', 1], self.load(b'["a", 1]', name='bundle.json'))
+
+    def test_yaml_flow_mapping(self):
+        self.assertEqual(
+            {'services': {}, 'series': 'trusty'},
+            self.load(b'{services: {}, series: trusty}'))
+
+    def test_empty(self):
+        self.assertIsNone(self.load(b''))
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def assertNotImported(self, module, heavy):
+        code = 'import sys, {}; print(sorted(sys.modules))'.format(module)
+        output = subprocess.check_output([sys.executable, '-c', code])
+        modules = output.decode('ascii')
+        for name in heavy:
+            self.assertNotIn("'{}'".format(name), modules)
+
+    def test_parse(self):
+        self.assertNotImported('bundleparser.parse', ['yaml', 'json'])
+
+    def test_command_line(self):
+        self.assertNotImported('bundleparser.bundleparser', ['yaml', 'json'])
+
+    def test_options(self):
+        self.assertNotImported('bundleparser.options', ['hashlib', 'json'])
+
+    def test_columnar(self):
+        self.assertNotImported('bundleparser.columnar', ['json'])
+
+
+class TestLoadDump(unittest.TestCase):
+
+    def test_load_bundle(self):
+        bundle = bundleparser.load_bundle(StringIO(
+            'services:\n  django:\n    charm: cs:trusty/django-42\n'))
+        self.assertEqual(
+            {'services': {'django': {'charm': 'cs:trusty/django-42'}}},
+            bundle)
+
+    def test_load_bundle_file(self):
+        path = os.path.join(
+            os.path.dirname(__file__), '..', 'fixtures', 'bundle.yaml')
+        with open(path, 'rb') as f:
+            content = f.read()
+        bundle, digest = bundleparser.load_bundle_file(path)
+        with open(path) as f:
+            self.assertEqual(bundleparser.load_bundle(f), bundle)
+        self.assertEqual(hashlib.sha256(content).hexdigest(), digest)
+
+    def test_dump_changes(self):
+        changes = [{'id': 'addCharm-0'}, {'id': 'addCharm-1'}]
+        stream = StringIO()
+        bundleparser.dump_changes(changes, stream)
+        self.assertEqual(changes, json.loads(stream.getvalue()))
+
+    def test_dump_options(self):
+        changes = [{'id': 'addService-0', 'args': ['cs:foo', 'foo', 'key']}]
+        stream = StringIO()
+        bundleparser.dump_changes(changes, stream, options={'key': {'a': 1}})
+        self.assertEqual(
+            {'changes': changes, 'options': {'key': {'a': 1}}},
+            json.loads(stream.getvalue()))
+
+    def test_dump_sort_keys(self):
+        stream = StringIO()
+        bundleparser.dump_changes(
+            [{'id': 'addCharm-0', 'args': []}], stream, sort_keys=True)
+        output = stream.getvalue()
+        self.assertTrue(output.index('"args"') < output.index('"id"'))
+
+    def test_dump_no_changes(self):
+        stream = StringIO()
+        bundleparser.dump_changes([], stream)
+        self.assertEqual([], json.loads(stream.getvalue()))
+
+
 if __name__ == '__main__':
     unittest.main()
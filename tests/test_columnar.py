@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_columnar
+----------------------------------
+
+Tests for `columnar` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bundleparser import (
+    columnar,
+    parse,
+)
+
+
+BUNDLE = {
+    'services': {
+        'django': {'charm': 'cs:trusty/django-42', 'num_units': 2, 'to': '1'},
+        'mysql': {'charm': 'cs:trusty/mysql-47', 'num_units': 1},
+    },
+    'machines': {'1': {'series': 'trusty'}},
+    'relations': [['django:db', 'mysql:db']],
+}
+
+
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.changesets = [
+            list(parse.parse(BUNDLE)),
+            [],
+            list(parse.parse({'services': {}, 'relations': []})),
+            list(parse.parse(BUNDLE)),
+        ]
+        self.rows = columnar.export(self.changesets, self.directory)
+
+    def open(self):
+        store = columnar.ColumnarChangeSets(self.directory)
+        self.addCleanup(store.close)
+        return store
+
+    def test_export(self):
+        self.assertEqual(
+            sum(len(changes) for changes in self.changesets), self.rows)
+        for name in list(columnar.COLUMNS) + [columnar.META_FILE]:
+            self.assertTrue(
+                os.path.exists(os.path.join(self.directory, name)))
+
+    def test_round_trip(self):
+        store = self.open()
+        self.assertEqual(self.rows, len(store))
+        self.assertEqual(4, store.changeset_count())
+        for index, changes in enumerate(self.changesets):
+            rows = store.changeset_rows(index)
+            self.assertEqual(len(changes), len(rows))
+            for row, change in zip(rows, changes):
+                self.assertEqual(change['id'], store.id(row))
+                self.assertEqual(change['method'], store.method(row))
+                self.assertEqual(
+                    change['requires'],
+                    [store.id(required) for required in store.requires(row)])
+
+    def test_close_with_requires(self):
+        # Required rows can be kept after the store is closed.
+        with columnar.ColumnarChangeSets(self.directory) as store:
+            requires = [store.requires(row) for row in range(len(store))]
+        changes = self.changesets[0]
+        positions = dict(
+            (change['id'], row) for row, change in enumerate(changes))
+        for row, change in enumerate(changes):
+            self.assertEqual(
+                tuple(positions[required] for required in change['requires']),
+                requires[row])
+
+    def test_method_counts(self):
+        counts = self.open().method_counts()
+        self.assertEqual(
+            {'addCharm': 4, 'deploy': 4, 'addMachine': 2, 'addRelation': 2,
+             'addUnit': 6},
+            dict(counts))
+
+    def test_fan_in(self):
+        store = self.open()
+        fan_in = dict(
+            (store.id(row), count) for row, count in store.fan_in().items()
+            if row in store.changeset_rows(0))
+        expected = {}
+        for change in self.changesets[0]:
+            for required in change['requires']:
+                expected[required] = expected.get(required, 0) + 1
+        self.assertEqual(expected, fan_in)
+
+    def test_units_per_machine(self):
+        store = self.open()
+        counts = store.units_per_machine()
+        self.assertEqual([2, 2], list(counts.values()))
+        for row in counts:
+            self.assertEqual('addMachine', store.method(row))
+
+    def test_unknown_requirement(self):
+        changes = [{'id': 'addUnit-0', 'method': 'addUnit',
+                    'requires': ['addService-9']}]
+        self.assertRaises(
+            ValueError, columnar.export, [changes], self.directory)
+
+    def test_invalid_id(self):
+        changes = [{'id': 'bad', 'method': 'addUnit', 'requires': []}]
+        self.assertRaises(
+            ValueError, columnar.export, [changes], self.directory)
+
+    def test_empty(self):
+        directory = os.path.join(self.directory, 'empty')
+        self.assertEqual(0, columnar.export([], directory))
+        with columnar.ColumnarChangeSets(directory) as store:
+            self.assertEqual(0, len(store))
+            self.assertEqual(0, store.changeset_count())
+            self.assertEqual({}, dict(store.method_counts()))
+            self.assertEqual({}, dict(store.units_per_machine()))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_constraints
+----------------------------------
+
+Tests for `constraints` module.
+"""
+
+import unittest
+
+from bundleparser import constraints
+
+
+class TestParseConstraints(unittest.TestCase):
+
+    def setUp(self):
+        constraints._cache.clear()
+
+    def test_empty(self):
+        self.assertEqual({}, constraints.parse_constraints(''))
+        self.assertEqual({}, constraints.parse_constraints({}))
+        self.assertEqual({}, constraints.parse_constraints(None))
+
+    def test_string(self):
+        self.assertEqual(
+            {'mem': 4096, 'cores': 2, 'arch': 'amd64'},
+            constraints.parse_constraints('mem=4G cores=2 arch=amd64'),
+        )
+
+    def test_sizes(self):
+        parse = constraints.parse_constraints
+        self.assertEqual({'mem': 512}, parse('mem=512'))
+        self.assertEqual({'mem': 512}, parse('mem=512M'))
+        self.assertEqual({'mem': 1536}, parse('mem=1.5G'))
+        self.assertEqual({'root-disk': 2097152}, parse('root-disk=2T'))
+        self.assertEqual({'root-disk': 1073741824}, parse('root-disk=1p'))
+
+    def test_lists(self):
+        self.assertEqual(
+            {'tags': ['foo', 'bar'], 'zones': ['zone1']},
+            constraints.parse_constraints('tags=foo,bar zones=zone1'),
+        )
+
+    def test_dict(self):
+        self.assertEqual(
+            {'cpu-cores': 4, 'mem': 2048, 'tags': ['foo']},
+            constraints.parse_constraints({
+                'cpu-cores': '4',
+                'mem': '2G',
+                'tags': ['foo'],
+            }),
+        )
+
+    def test_invalid(self):
+        def parse(value):
+            return constraints.parse_constraints(value, strict=True)
+        self.assertRaises(ValueError, parse, 'mem')
+        self.assertRaises(ValueError, parse, '=4G')
+        self.assertRaises(ValueError, parse, 'mem=lots')
+        self.assertRaises(ValueError, parse, 'mem=4GB')
+        self.assertRaises(ValueError, parse, 'mem=-1G')
+        self.assertRaises(ValueError, parse, 'mem=inf')
+        self.assertRaises(ValueError, parse, 'mem=-inf')
+        self.assertRaises(ValueError, parse, 'mem=nan')
+        self.assertRaises(ValueError, parse, 'root-disk=1e400')
+        self.assertRaises(ValueError, parse, {'mem': float('inf')})
+        self.assertRaises(ValueError, parse, 'cores=many')
+        self.assertRaises(ValueError, parse, 'arch=z80')
+        self.assertRaises(ValueError, parse, {'cpu-cores': None})
+
+    def test_strict_unknown(self):
+        self.assertEqual(
+            {'mem': 4096, 'image-id': 'ami-1', 'instance-role': 'auto'},
+            constraints.parse_constraints(
+                'mem=4G image-id=ami-1 instance-role=auto', strict=True))
+
+    def test_passthrough(self):
+        parse = constraints.parse_constraints
+        self.assertEqual(
+            {'mem': 4096, 'allocate-public-ip': 'true', 'image-id': 'ami-1'},
+            parse('mem=4G allocate-public-ip=true image-id=ami-1'))
+        self.assertEqual(
+            {'mem': '4GB', 'root-disk': 'inf', 'arch': 'z80'},
+            parse('mem=4GB root-disk=inf arch=z80'))
+        self.assertEqual({'mem': 'nan'}, parse({'mem': 'nan'}))
+        self.assertEqual('mem', parse('mem'))
+
+    def test_memoized(self):
+        first = constraints.parse_constraints('mem=4G tags=foo')
+        self.assertIn(('mem=4G tags=foo', False), constraints._cache)
+        # Changing a returned value does not alter the cached one.
+        first['tags'].append('bar')
+        first['mem'] = 0
+        self.assertEqual(
+            {'mem': 4096, 'tags': ['foo']},
+            constraints.parse_constraints('mem=4G tags=foo'),
+        )
+
+    def test_cache_size(self):
+        for i in range(constraints.CACHE_SIZE + 1):
+            constraints.parse_constraints('cores={}'.format(i))
+        self.assertTrue(len(constraints._cache) <= constraints.CACHE_SIZE)
+
+
+class TestConstraintsKey(unittest.TestCase):
+
+    def test_equal(self):
+        self.assertEqual(
+            constraints.constraints_key({'mem': 4096, 'tags': ['a']}),
+            constraints.constraints_key({'tags': ['a'], 'mem': 4096}),
+        )
+
+    def test_unparsed(self):
+        self.assertEqual('mem', constraints.constraints_key('mem'))
+
+    def test_hashable(self):
+        key = constraints.constraints_key({'tags': ['a', 'b']})
+        self.assertEqual({key: 1}[key], 1)
+
+    def test_nested_values(self):
+        key = constraints.constraints_key(
+            {'foo': {'b': [1, {'c': 2}], 'a': 1}})
+        self.assertEqual({key: 1}[key], 1)
+        self.assertEqual(key, constraints.constraints_key(
+            {'foo': {'a': 1, 'b': [1, {'c': 2}]}}))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_flatten
+----------------------------------
+
+Tests for `flatten` module.
+"""
+
+from collections import OrderedDict
+import copy
+import unittest
+
+from bundleparser import flatten
+
+
+def make_bundles():
+    return OrderedDict((
+        ('base', {
+            'series': 'trusty',
+            'services': {
+                'mysql': {
+                    'charm': 'cs:trusty/mysql-1',
+                    'num_units': 1,
+                    'options': {'dataset-size': '50%', 'flavor': 'distro'},
+                },
+                'wordpress': {
+                    'charm': 'cs:trusty/wordpress-2',
+                    'num_units': 1,
+                },
+            },
+            'relations': [['wordpress:db', 'mysql:db']],
+        }),
+        ('scaled', {
+            'inherits': 'base',
+            'services': {
+                'wordpress': {'num_units': 3},
+                'haproxy': {'charm': 'cs:trusty/haproxy-3', 'num_units': 1},
+            },
+            'relations': [
+                ['haproxy:reverseproxy', 'wordpress:website'],
+                ['wordpress:db', 'mysql:db'],
+            ],
+        }),
+        ('tuned', {
+            'inherits': ['scaled'],
+            'services': {
+                'mysql': {'options': {'dataset-size': '80%'}},
+            },
+        }),
+    ))
+
+
+class TestFlatten(unittest.TestCase):
+
+    def test_no_inheritance(self):
+        bundles = make_bundles()
+        self.assertEqual(bundles['base'], flatten.flatten(bundles, 'base'))
+
+    def test_inheritance(self):
+        bundles = make_bundles()
+        original = copy.deepcopy(bundles)
+        tuned = flatten.flatten(bundles, 'tuned')
+        self.assertEqual({
+            'series': 'trusty',
+            'services': {
+                'mysql': {
+                    'charm': 'cs:trusty/mysql-1',
+                    'num_units': 1,
+                    'options': {'dataset-size': '80%', 'flavor': 'distro'},
+                },
+                'wordpress': {
+                    'charm': 'cs:trusty/wordpress-2',
+                    'num_units': 3,
+                },
+                'haproxy': {'charm': 'cs:trusty/haproxy-3', 'num_units': 1},
+            },
+            'relations': [
+                ['wordpress:db', 'mysql:db'],
+                ['haproxy:reverseproxy', 'wordpress:website'],
+            ],
+        }, tuned)
+        # The input bundles are not modified.
+        self.assertEqual(original, bundles)
+
+    def test_structural_sharing(self):
+        bundles = make_bundles()
+        flattener = flatten.Flattener(bundles)
+        base = flattener.resolve('base')
+        scaled = flattener.resolve('scaled')
+        tuned = flattener.resolve('tuned')
+        # Values which are not overridden are shared, not copied.
+        self.assertIs(
+            base['services']['mysql'], scaled['services']['mysql'])
+        self.assertIs(
+            scaled['services']['wordpress'], tuned['services']['wordpress'])
+        self.assertIs(scaled['relations'], tuned['relations'])
+        # Ancestors are only resolved once.
+        self.assertIs(base, flattener.resolve('base'))
+
+    def test_multiple_inheritance(self):
+        bundles = {
+            'a': {'series': 'trusty', 'services': {'x': {'num_units': 1}}},
+            'b': {'series': 'vivid', 'services': {'y': {'num_units': 2}}},
+            'c': {'inherits': ['a', 'b']},
+        }
+        self.assertEqual({
+            'series': 'vivid',
+            'services': {'x': {'num_units': 1}, 'y': {'num_units': 2}},
+        }, flatten.flatten(bundles, 'c'))
+
+    def test_flatten_all(self):
+        bundles = make_bundles()
+        flattened = flatten.flatten(bundles)
+        self.assertEqual(['base', 'scaled', 'tuned'], list(flattened))
+        for bundle in flattened.values():
+            self.assertNotIn('inherits', bundle)
+
+    def test_deep_inheritance(self):
+        bundles = {'bundle-0': {'services': {}}}
+        for i in range(1, 5000):
+            bundles['bundle-{}'.format(i)] = {
+                'inherits': 'bundle-{}'.format(i - 1),
+                'series': str(i),
+            }
+        self.assertEqual(
+            {'services': {}, 'series': '4999'},
+            flatten.flatten(bundles, 'bundle-4999'))
+
+    def test_cycle(self):
+        bundles = {
+            'a': {'inherits': 'c'},
+            'b': {'inherits': 'a'},
+            'c': {'inherits': ['b']},
+        }
+        self.assertRaises(ValueError, flatten.flatten, bundles, 'a')
+        self.assertRaises(
+            ValueError, flatten.flatten, {'a': {'inherits': 'a'}})
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, flatten.flatten, {}, 'a')
+        self.assertRaises(
+            ValueError, flatten.flatten, {'a': {'inherits': 'b'}}, 'a')
+
+
+class TestParseBundles(unittest.TestCase):
+
+    def test_parse(self):
+        results = dict(
+            (name, list(changes))
+            for name, changes in flatten.parse_bundles(make_bundles()))
+        self.assertEqual(['base', 'scaled', 'tuned'], sorted(results))
+        methods = [change['method'] for change in results['scaled']]
+        self.assertEqual(3, methods.count('deploy'))
+        self.assertEqual(2, methods.count('addRelation'))
+        self.assertEqual(5, methods.count('addUnit'))
+
+    def test_nested_relations(self):
+        bundles = make_bundles()
+        bundles['base']['services']['mediawiki'] = {
+            'charm': 'cs:trusty/mediawiki-3', 'num_units': 1}
+        bundles['base']['relations'] = [
+            ['mysql:db', ['wordpress:db', 'mediawiki:db']]]
+        flattened = flatten.flatten(bundles)
+        self.assertEqual(
+            [['mysql:db', 'wordpress:db'], ['mysql:db', 'mediawiki:db']],
+            flattened['base']['relations'])
+        # Relations of the child bundle are added to the expanded ones,
+        # except the one repeating a parent relation the other way round.
+        self.assertEqual(
+            [['mysql:db', 'wordpress:db'], ['mysql:db', 'mediawiki:db'],
+             ['haproxy:reverseproxy', 'wordpress:website']],
+            flattened['scaled']['relations'])
+        changes = list(dict(flatten.parse_bundles(bundles))['base'])
+        relations = [change for change in changes
+                     if change['method'] == 'addRelation']
+        self.assertEqual(
+            [['mysql', 'wordpress'], ['mysql', 'mediawiki']],
+            [[arg[1]['name'] for arg in change['args']]
+             for change in relations])
+
+    def test_reversed_relations(self):
+        bundles = make_bundles()
+        bundles['scaled']['relations'].append(['mysql:db', 'wordpress:db'])
+        bundles['scaled']['relations'].append(['mysql:db', 'wordpress:db'])
+        self.assertEqual(
+            [['wordpress:db', 'mysql:db'],
+             ['haproxy:reverseproxy', 'wordpress:website']],
+            flatten.flatten(bundles, 'scaled')['relations'])
+
+    def test_peer_relations(self):
+        bundles = {'base': {
+            'services': {'ceph': {'charm': 'cs:trusty/ceph-1'}},
+            'relations': [['ceph:cluster'], ['ceph:mon', 'ceph:osd']],
+        }}
+        self.assertEqual(
+            [['ceph:cluster'], ['ceph:mon', 'ceph:osd']],
+            flatten.flatten(bundles, 'base')['relations'])
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_fuzz
+----------------------------------
+
+Differential tests comparing the optimized code paths of `parse` with the
+reference implementation, using the `fuzz` harness.
+"""
+
+from collections import OrderedDict
+import random
+import unittest
+
+from bundleparser import (
+    options,
+    parse,
+)
+
+from . import (
+    fuzz,
+    reference,
+)
+
+
+CASES = 60
+
+
+def sorted_bundle(bundle):
+    """Return a copy of bundle with services and machines in canonical order.
+    """
+    bundle = dict(bundle)
+    bundle['services'] = OrderedDict(
+        (name, bundle['services'][name])
+        for name in sorted(bundle['services']))
+    if 'machines' in bundle:
+        bundle['machines'] = OrderedDict(
+            (name, bundle['machines'][name]) for name in sorted(
+                bundle['machines'], key=parse._machine_sort_key))
+    return bundle
+
+
+class TestHarness(unittest.TestCase):
+
+    def test_generate_deterministic(self):
+        self.assertEqual(
+            fuzz.generate_bundle(random.Random(42), 10),
+            fuzz.generate_bundle(random.Random(42), 10))
+
+    def test_generate_valid(self):
+        for seed in range(100):
+            bundle = fuzz.generate_bundle(random.Random(seed), seed % 20 + 1)
+            reference.parse(bundle)
+
+    def test_normalize(self):
+        changes = [
+            {'id': 'addCharm-7', 'method': 'addCharm', 'args': ['cs:foo'],
+             'requires': []},
+            {'id': 'addService-9', 'method': 'deploy',
+             'args': ['cs:foo', 'foo', {'b': 1, 'a': 2}],
+             'requires': ['addCharm-7']},
+            {'id': 'addUnit-10', 'method': 'addUnit',
+             'args': ('$addService-9', 1, None), 'requires': []},
+        ]
+        renumbered = [
+            {'id': 'addCharm-0', 'method': 'addCharm', 'args': ['cs:foo'],
+             'requires': []},
+            {'id': 'addService-1', 'method': 'deploy',
+             'args': ['cs:foo', 'foo', {'a': 2, 'b': 1}],
+             'requires': ['addCharm-0']},
+            {'id': 'addUnit-2', 'method': 'addUnit',
+             'args': ['$addService-1', 1, None], 'requires': []},
+        ]
+        self.assertEqual(fuzz.normalize(renumbered), fuzz.normalize(changes))
+
+    def test_shrink(self):
+        # A candidate ignoring the placement directives of services with
+        # more than one unit.
+        def candidate(bundle):
+            for service in bundle['services'].values():
+                if service['num_units'] > 1:
+                    service.pop('to', None)
+            return reference.parse(bundle)
+        for seed in range(CASES):
+            result = fuzz.run_case(reference.parse, candidate, seed, 10)
+            if not result.ok:
+                break
+        else:
+            self.fail('no failing case found')
+        services = result.bundle['services']
+        self.assertEqual(1, len(services))
+        self.assertEqual(2, list(services.values())[0]['num_units'])
+        self.assertEqual(1, len(result.bundle['machines']))
+        self.assertEqual([], result.bundle['relations'])
+
+    def test_ratio(self):
+        results = fuzz.fuzz(reference.parse, reference.parse, cases=4)
+        self.assertEqual([True] * 4, [result.ok for result in results])
+        for result in results:
+            self.assertTrue(result.ratio > 0)
+
+
+class TestDifferential(unittest.TestCase):
+
+    def assertAgree(self, candidate, reference_parser=reference.parse):
+        failures = [
+            result for result in fuzz.fuzz(
+                reference_parser, candidate, cases=CASES)
+            if not result.ok]
+        self.assertEqual([], [result.bundle for result in failures])
+
+    def test_parse(self):
+        self.assertAgree(parse.parse)
+
+    def test_buffered(self):
+        self.assertAgree(lambda bundle: parse.parse(bundle, buffer_size=3))
+
+    def test_canonical(self):
+        self.assertAgree(
+            lambda bundle: parse.parse(bundle, canonical=True),
+            lambda bundle: reference.parse(sorted_bundle(bundle)))
+
+    def test_shared_options(self):
+        def candidate(bundle):
+            table = {}
+            shared = list(options.share_options(parse.parse(bundle), table))
+            return options.expand_options(shared, table)
+        self.assertAgree(candidate)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_graph
+----------------------------------
+
+Tests for `graph` module.
+"""
+
+from collections import OrderedDict
+import unittest
+
+from bundleparser import (
+    graph,
+    parse,
+)
+
+
+def make_bundle():
+    return {
+        'series': 'trusty',
+        'services': OrderedDict((
+            ('wordpress', {'charm': 'cs:trusty/wordpress-1', 'num_units': 2,
+                           'to': ['1', 'lxc:2']}),
+            ('mysql', {'charm': 'cs:trusty/mysql-1', 'num_units': 1}),
+            ('mediawiki', {'charm': 'cs:trusty/mediawiki-1',
+                           'num_units': 1}),
+            ('memcached', {'charm': 'cs:trusty/memcached-1', 'num_units': 1,
+                           'to': 'lxc:mediawiki/0'}),
+            ('ntp', {'charm': 'cs:trusty/ntp-1', 'num_units': 1,
+                     'to': '3'}),
+            ('haproxy', {'charm': 'cs:trusty/haproxy-1', 'num_units': 1}),
+        )),
+        'machines': OrderedDict((
+            (1, {}), (2, {}), (3, {}), (4, {'series': 'vivid'}),
+        )),
+        'relations': [
+            ['wordpress:db', 'mysql:db'],
+            ['haproxy:reverseproxy', 'wordpress:website'],
+        ],
+    }
+
+
+class TestUnionFind(unittest.TestCase):
+
+    def test_union(self):
+        forest = graph.UnionFind(5)
+        forest.union(0, 1)
+        forest.union(3, 4)
+        forest.union(1, 4)
+        self.assertEqual(forest.find(0), forest.find(3))
+        self.assertNotEqual(forest.find(0), forest.find(2))
+        self.assertEqual(2, forest.find(2))
+
+    def test_large(self):
+        size = 100000
+        forest = graph.UnionFind(size)
+        for i in range(1, size):
+            forest.union(i - 1, i)
+        self.assertEqual(forest.find(0), forest.find(size - 1))
+
+
+class TestComponents(unittest.TestCase):
+
+    def test_components(self):
+        self.assertEqual(
+            [
+                (['wordpress', 'mysql', 'haproxy'], [1, 2]),
+                (['mediawiki', 'memcached'], []),
+                (['ntp'], [3]),
+                ([], [4]),
+            ],
+            graph.components(make_bundle()))
+
+    def test_v3(self):
+        bundle = {
+            'services': OrderedDict((
+                ('a', {'to': 'lxc:b=0'}),
+                ('b', {}),
+                ('c', {'to': '0'}),
+                ('d', {}),
+                ('e', {}),
+            )),
+            'relations': [['d:foo', ['e:bar', 'c:baz']]],
+        }
+        self.assertEqual(
+            [(['a', 'b'], []), (['c', 'd', 'e'], [])],
+            graph.components(bundle))
+
+    def test_empty(self):
+        self.assertEqual([], graph.components({'services': {}}))
+
+
+class TestPartition(unittest.TestCase):
+
+    def test_partition(self):
+        bundle = make_bundle()
+        bundles = graph.partition(bundle)
+        self.assertEqual(4, len(bundles))
+        first = bundles[0]
+        self.assertEqual('trusty', first['series'])
+        self.assertEqual(
+            ['wordpress', 'mysql', 'haproxy'], list(first['services']))
+        self.assertEqual([1, 2], list(first['machines']))
+        self.assertEqual(bundle['relations'], first['relations'])
+        self.assertEqual([], bundles[1]['relations'])
+        self.assertEqual({4: {'series': 'vivid'}}, bundles[3]['machines'])
+
+    def test_v3_no_machines(self):
+        bundles = graph.partition({'services': {'a': {}}, 'relations': []})
+        self.assertNotIn('machines', bundles[0])
+
+    def test_parse_partitions(self):
+        plans = graph.parse_partitions(make_bundle())
+        methods = [sorted(set(change['method'] for change in changes))
+                   for changes in plans]
+        self.assertEqual(
+            ['addCharm', 'addMachine', 'addRelation', 'addUnit', 'deploy'],
+            methods[0])
+        self.assertEqual(['addCharm', 'addUnit', 'deploy'], methods[1])
+        self.assertEqual(['addMachine'], methods[3])
+        # Every requirement is satisfied within its own partition.
+        for changes in plans:
+            ids = set(change['id'] for change in changes)
+            for change in changes:
+                self.assertTrue(set(change['requires']) <= ids)
+
+    def test_parse_partitions_ids(self):
+        bundle = make_bundle()
+        # Share a charm between two components.
+        bundle['services']['ntp']['charm'] = 'cs:trusty/mysql-1'
+        expected = list(parse.parse(bundle))
+        plans = graph.parse_partitions(bundle)
+        # Ids are the ones of the full change set, and the union of the
+        # partitions is the full change set.
+        obtained = dict(
+            (change['id'], change) for changes in plans for change in changes)
+        self.assertEqual(
+            dict((change['id'], change) for change in expected), obtained)
+        # Each partition keeps the order of the full change set.
+        positions = dict(
+            (change['id'], i) for i, change in enumerate(expected))
+        for changes in plans:
+            ids = [positions[change['id']] for change in changes]
+            self.assertEqual(sorted(ids), ids)
+        # The shared charm is added by both partitions using it.
+        charm_ids = [change['id'] for changes in plans for change in changes
+                     if change['args'] == ['cs:trusty/mysql-1']]
+        self.assertEqual(2, len(charm_ids))
+        self.assertEqual(1, len(set(charm_ids)))
+
+    def test_parse_partitions_canonical(self):
+        bundle = make_bundle()
+        plans = graph.parse_partitions(bundle, canonical=True)
+        self.assertEqual(
+            sorted(change['id']
+                   for change in parse.parse(bundle, canonical=True)),
+            sorted(set(change['id']
+                       for changes in plans for change in changes)))
+
+    def test_parse_partitions_unassigned(self):
+        def handle_notes(changeset):
+            changeset.send({
+                'id': 'addNote-{}'.format(changeset.next_action()),
+                'method': 'addNote',
+                'args': [],
+                'requires': [],
+            })
+        registry = parse.HandlerRegistry()
+        registry.register('notes', handle_notes)
+        pipeline = registry.compile()
+        bundle = {'services': {}, 'relations': []}
+        self.assertEqual(
+            [list(parse.parse(bundle, pipeline=pipeline))],
+            graph.parse_partitions(bundle, pipeline=pipeline))
+        self.assertEqual([], graph.parse_partitions(bundle))
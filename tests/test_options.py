@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_options
+----------------------------------
+
+Tests for `options` module.
+"""
+
+from collections import OrderedDict
+import copy
+import unittest
+
+from bundleparser import (
+    options,
+    parse,
+)
+
+
+class TestOptionsKey(unittest.TestCase):
+
+    def test_order_independent(self):
+        self.assertEqual(
+            options.options_key(OrderedDict((('a', 1), ('b', 2)))),
+            options.options_key(OrderedDict((('b', 2), ('a', 1)))),
+        )
+
+    def test_different(self):
+        self.assertNotEqual(
+            options.options_key({'a': 1}),
+            options.options_key({'a': '1'}),
+        )
+
+
+class TestShareOptions(unittest.TestCase):
+
+    def setUp(self):
+        cert = '-----BEGIN CERTIFICATE-----\n' + 'A' * 1024
+        self.bundle = {
+            'services': OrderedDict((
+                ('web1', {'charm': 'cs:trusty/apache2-1',
+                          'options': {'cert': cert}}),
+                ('web2', {'charm': 'cs:trusty/apache2-1',
+                          'options': {'cert': cert}}),
+                ('db', {'charm': 'cs:trusty/mysql-1'}),
+            )),
+        }
+        cs = parse.ChangeSet(self.bundle)
+        parse.handle_services(cs)
+        self.changes = cs.recv()
+
+    def test_share(self):
+        original = copy.deepcopy(self.changes)
+        table = {}
+        shared = list(options.share_options(self.changes, table))
+        key = options.options_key({'cert': self.bundle['services'][
+            'web1']['options']['cert']})
+        self.assertEqual([key], list(table))
+        deploys = [c for c in shared if c['method'] == 'deploy']
+        self.assertEqual(
+            [key, key, {}], [c['args'][2] for c in deploys])
+        # The original changes are left untouched.
+        self.assertEqual(original, self.changes)
+
+    def test_round_trip(self):
+        table = {}
+        shared = list(options.share_options(self.changes, table))
+        self.assertEqual(
+            self.changes, list(options.expand_options(shared, table)))
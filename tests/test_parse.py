@@ -9,7 +9,14 @@ Tests for `parse` module.
 """
 
 from collections import OrderedDict
+import threading
 import unittest
+import warnings
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 from bundleparser import parse
 
@@ -68,6 +75,38 @@ class TestParsePlacements(unittest.TestCase):
             parse.UnitPlacement('lxc', '', 'mysql', '1'),
         )
 
+    def test_unit_placement_parser(self):
+        self.assertIs(
+            parse._parse_v3_unit_placement,
+            parse.unit_placement_parser({'services': {}}))
+        self.assertIs(
+            parse._parse_v4_unit_placement,
+            parse.unit_placement_parser({'services': {}, 'machines': {}}))
+
+    def test_parse_edge_cases(self):
+        self.assertEqual(
+            ('kvm', '12', '', ''),
+            tuple(parse._parse_v4_unit_placement('kvm:12')))
+        self.assertEqual(
+            ('', '12', '', '3'),
+            tuple(parse._parse_v4_unit_placement('12/3')))
+        # Unit separators of the other bundle version are not special.
+        self.assertEqual(
+            ('', '', 'mysql=1', ''),
+            tuple(parse._parse_v4_unit_placement('mysql=1')))
+        self.assertEqual(
+            ('', '', 'mysql/1', ''),
+            tuple(parse._parse_v3_unit_placement('mysql/1')))
+        self.assertEqual(
+            ('lxc', '', '', ''),
+            tuple(parse._parse_v3_unit_placement('lxc:')))
+        for placement in ('lxc:kvm:0', 'mysql=1=2'):
+            self.assertRaises(
+                ValueError, parse._parse_v3_unit_placement, placement)
+        for placement in ('lxc:kvm:0', 'mysql/1/2'):
+            self.assertRaises(
+                ValueError, parse._parse_v4_unit_placement, placement)
+
 
 class TestChangeSet(unittest.TestCase):
 
@@ -86,6 +125,49 @@ class TestChangeSet(unittest.TestCase):
         self.assertEqual([], self.cs.recv())
 
 
+class TestCanonicalOrder(unittest.TestCase):
+
+    def make_bundle(self, services, machines):
+        return {
+            'services': OrderedDict(
+                (name, {
+                    'charm': 'cs:trusty/{}-1'.format(name),
+                    'num_units': 2,
+                    'to': '10',
+                }) for name in services),
+            'machines': OrderedDict(
+                (name, {'series': 'trusty'}) for name in machines),
+            'relations': [['django:db', 'mysql:db']],
+        }
+
+    def test_machine_sort_key(self):
+        self.assertEqual(
+            ['1', 2, '10', 'a', 'b'],
+            sorted(['b', '10', 'a', 2, '1'], key=parse._machine_sort_key))
+
+    def test_names(self):
+        cs = parse.ChangeSet(
+            self.make_bundle(['mysql', 'django'], ['10', '9']),
+            canonical=True)
+        self.assertEqual(['django', 'mysql'], cs.service_names)
+        self.assertEqual(['9', '10'], cs.machine_names)
+
+    def test_default_order(self):
+        cs = parse.ChangeSet(
+            self.make_bundle(['mysql', 'django'], ['10', '9']))
+        self.assertEqual(['mysql', 'django'], cs.service_names)
+        self.assertEqual(['10', '9'], cs.machine_names)
+
+    def test_equal_bundles(self):
+        bundle1 = self.make_bundle(['mysql', 'django', 'nginx'], ['10', '9'])
+        bundle2 = self.make_bundle(['nginx', 'django', 'mysql'], ['9', '10'])
+        self.assertNotEqual(
+            list(parse.parse(bundle1)), list(parse.parse(bundle2)))
+        self.assertEqual(
+            list(parse.parse(bundle1, canonical=True)),
+            list(parse.parse(bundle2, canonical=True)))
+
+
 class TestParse(unittest.TestCase):
 
     def handler1(self, changeset):
@@ -105,7 +187,11 @@ class TestParse(unittest.TestCase):
             'relations': {},
             'series': 'trusty',
         }
-        changes = list(parse.parse(bundle, handler=self.handler1))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            changes = list(parse.parse(bundle, handler=self.handler1))
+        self.assertEqual(
+            [DeprecationWarning], [warning.category for warning in caught])
         self.assertEqual(
             [
                 (1, 0),
@@ -119,6 +205,295 @@ class TestParse(unittest.TestCase):
         )
 
 
+class TestBufferedParse(unittest.TestCase):
+
+    def make_pipeline(self, handler):
+        return parse.Pipeline([parse.Stage('test', handler, (), ())])
+
+    def make_bundle(self, num_units):
+        return {
+            'services': OrderedDict((
+                ('django', {'charm': 'cs:trusty/django-42',
+                            'num_units': num_units, 'to': ['1', '2']}),
+                ('mysql', {'charm': 'cs:trusty/mysql-47', 'num_units': 2}),
+            )),
+            'machines': OrderedDict((('1', {}), ('2', {}))),
+            'relations': [['django:db', 'mysql:db']],
+        }
+
+    def test_same_changes(self):
+        bundle = self.make_bundle(10)
+        self.assertEqual(
+            list(parse.parse(bundle)),
+            list(parse.parse(bundle, buffer_size=1)))
+
+    def test_handler_error(self):
+        def handler(changeset):
+            changeset.send('foo')
+            raise KeyError('bad')
+        changes = parse.parse(
+            {}, pipeline=self.make_pipeline(handler), buffer_size=10)
+        self.assertEqual('foo', next(changes))
+        self.assertRaises(KeyError, next, changes)
+
+    def test_handler_exit(self):
+        def handler(changeset):
+            changeset.send('foo')
+            raise SystemExit(1)
+        changes = parse.parse(
+            {}, pipeline=self.make_pipeline(handler), buffer_size=10)
+        self.assertEqual('foo', next(changes))
+        self.assertRaises(SystemExit, next, changes)
+
+    def test_tuples(self):
+        def handler(changeset):
+            changeset.send(())
+            changeset.send((None, None))
+        changes = parse.parse(
+            {}, pipeline=self.make_pipeline(handler), buffer_size=1)
+        self.assertEqual([(), (None, None)], list(changes))
+
+    def test_consumer_closed(self):
+        caught = []
+
+        def handler(changeset):
+            try:
+                for i in range(100):
+                    changeset.send(i)
+            except Exception as err:
+                caught.append(err)
+        changes = parse.parse(
+            {}, pipeline=self.make_pipeline(handler), buffer_size=1)
+        next(changes)
+        changes.close()
+        # Closing is not reported as an error to handlers.
+        self.assertEqual([], caught)
+
+    def test_send_closed(self):
+        cs = parse.BufferedChangeSet({}, 1)
+        cs.closed = True
+        self.assertRaises(parse._ConsumerClosed, cs.send, 'foo')
+
+    def test_get(self):
+        cs = parse.BufferedChangeSet({}, 2)
+        cs.send('foo')
+        cs.send('bar')
+        self.assertEqual('foo', cs.get())
+        self.assertEqual('bar', cs.get())
+
+    def test_backpressure(self):
+        sent = []
+
+        def handler(changeset):
+            for i in range(100):
+                changeset.send(i)
+                sent.append(i)
+        changes = parse.parse(
+            {}, pipeline=self.make_pipeline(handler), buffer_size=5)
+        self.assertEqual(0, next(changes))
+        # The producer cannot get more than the buffer size ahead.
+        self.assertTrue(len(sent) <= 7)
+        changes.close()
+
+    def test_close(self):
+        threads = threading.active_count()
+        changes = parse.parse(
+            self.make_bundle(1000), buffer_size=1)
+        next(changes)
+        changes.close()
+        self.assertEqual(threads, threading.active_count())
+
+    def test_invalid_buffer_size(self):
+        self.assertRaises(ValueError, parse.parse, {}, buffer_size=0)
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc not available')
+    def test_bounded_memory(self):
+        def peak(num_units):
+            bundle = self.make_bundle(num_units)
+            tracemalloc.start()
+            try:
+                for change in parse.parse(bundle, buffer_size=100):
+                    pass
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        small, large = peak(1000), peak(20000)
+        # Without the buffer, the large bundle takes about 10 megabytes.
+        self.assertTrue(
+            large < small * 2, 'peak {} > 2 * {}'.format(large, small))
+
+
+class TestHandlerRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.bundle = {
+            'services': OrderedDict((
+                ('django', {'charm': 'cs:trusty/django-42', 'num_units': 1,
+                            'annotations': {'gui-x': '10'}}),
+                ('mysql', {'charm': 'cs:trusty/mysql-47', 'num_units': 1}),
+            )),
+            'machines': {},
+            'relations': [['django:db', 'mysql:db']],
+        }
+
+    def handle_annotations(self, changeset):
+        for service_name, service in changeset.services():
+            if 'annotations' in service:
+                record_id = changeset.services_added[service_name]
+                changeset.send({
+                    'id': 'setAnnotations-{}'.format(changeset.next_action()),
+                    'method': 'setAnnotations',
+                    'args': [
+                        '${}'.format(record_id),
+                        'service',
+                        service['annotations'],
+                    ],
+                    'requires': [record_id],
+                })
+                changeset.annotations_added[service_name] = True
+
+    def make_registry(self):
+        registry = parse.HandlerRegistry()
+        for stage in parse.registry.compile().stages:
+            registry.register(*stage)
+        return registry
+
+    def test_default(self):
+        self.assertEqual(
+            ['services', 'machines', 'relations', 'units'],
+            parse.registry.names())
+        # The built-in handlers do not chain, and starting a deprecated chain
+        # with the first one runs the default pipeline instead.
+        self.assertIsNone(parse.handle_services(parse.ChangeSet(self.bundle)))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            changes = list(
+                parse.parse(self.bundle, handler=parse.handle_services))
+        self.assertEqual(list(parse.parse(self.bundle)), changes)
+
+    def test_pipeline_changes(self):
+        changeset = parse.ChangeSet(self.bundle)
+        changes = list(parse.registry.compile().changes(changeset))
+        self.assertEqual(list(parse.parse(self.bundle)), changes)
+        self.assertEqual(
+            {'django': 'addService-1', 'mysql': 'addService-3'},
+            changeset.services_added)
+
+    def test_compile_cached(self):
+        registry = self.make_registry()
+        pipeline = registry.compile()
+        self.assertIs(pipeline, registry.compile())
+        registry.unregister('units')
+        self.assertIsNot(pipeline, registry.compile())
+
+    def test_custom_stage(self):
+        registry = self.make_registry()
+        # Stages requiring an index run after the stage producing it.
+        registry.register(
+            'check', lambda changeset: None, inputs=['annotations_added'])
+        registry.register(
+            'annotations', self.handle_annotations,
+            inputs=['services_added'], outputs=['annotations_added'])
+        self.assertEqual(
+            ['services', 'machines', 'relations', 'units', 'annotations',
+             'check'],
+            [stage.name for stage in registry.compile().stages])
+        changes = list(parse.parse(
+            self.bundle, pipeline=registry.compile()))
+        self.assertEqual(
+            {
+                'id': 'setAnnotations-7',
+                'method': 'setAnnotations',
+                'args': ['$addService-1', 'service', {'gui-x': '10'}],
+                'requires': ['addService-1'],
+            },
+            changes[-1])
+
+    def test_profile(self):
+        registry = self.make_registry()
+        registry.register(
+            'annotations', self.handle_annotations,
+            inputs=['services_added'], outputs=['annotations_added'])
+        profile = {}
+        for change in parse.parse(
+                self.bundle, pipeline=registry.compile(), profile=profile,
+                buffer_size=2):
+            pass
+        self.assertEqual(
+            ['annotations', 'machines', 'relations', 'services', 'units'],
+            sorted(profile))
+        for elapsed in profile.values():
+            self.assertTrue(elapsed >= 0)
+
+    def test_handler_chain_to_builtin(self):
+        # A custom handler returning a built-in one runs the rest of the
+        # default pipeline.
+        def handler(changeset):
+            changeset.send('custom')
+            return parse.handle_services
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            changes = list(parse.parse(self.bundle, handler=handler))
+        self.assertEqual(['custom'] + list(parse.parse(self.bundle)), changes)
+
+    def test_handler_chain_from_builtin(self):
+        # Starting from a later built-in handler runs the following stages.
+        def handler(changeset):
+            parse.handle_services(changeset)
+            return parse.handle_machines
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            changes = list(parse.parse(self.bundle, handler=handler))
+        self.assertEqual(list(parse.parse(self.bundle)), changes)
+        bundle = {'services': {}, 'machines': {'1': {}}, 'relations': []}
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            changes = list(
+                parse.parse(bundle, handler=parse.handle_machines))
+        self.assertEqual(list(parse.parse(bundle)), changes)
+
+    def test_profile_handler_chain(self):
+        def handler1(changeset):
+            return handler2
+
+        def handler2(changeset):
+            return None
+        profile = {}
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            list(parse.parse(self.bundle, handler=handler1, profile=profile))
+        self.assertEqual(['handler1', 'handler2'], sorted(profile))
+
+    def test_indexes_reset(self):
+        registry = parse.HandlerRegistry()
+
+        def producer(changeset):
+            changeset.send(len(changeset.seen))
+            changeset.seen['foo'] = 1
+        registry.register('producer', producer, outputs=['seen'])
+        pipeline = registry.compile()
+        self.assertEqual([0], list(parse.parse({}, pipeline=pipeline)))
+        self.assertEqual([0], list(parse.parse({}, pipeline=pipeline)))
+
+    def test_errors(self):
+        registry = parse.HandlerRegistry()
+        registry.register('a', None, outputs=['x'])
+        self.assertRaises(ValueError, registry.register, 'a', None)
+        self.assertRaises(ValueError, registry.unregister, 'b')
+
+        registry.register('b', None, outputs=['x'])
+        self.assertRaises(ValueError, registry.compile)
+        registry.unregister('b')
+
+        registry.register('c', None, inputs=['missing'])
+        self.assertRaises(ValueError, registry.compile)
+        registry.unregister('c')
+
+        registry.register('d', None, inputs=['y'], outputs=['z'])
+        registry.register('e', None, inputs=['z'], outputs=['y'])
+        self.assertRaises(ValueError, registry.compile)
+
+
 class TestHandleServices(unittest.TestCase):
 
     def test_handler(self):
@@ -142,7 +517,7 @@ class TestHandleServices(unittest.TestCase):
             ))
         })
         handler = parse.handle_services(cs)
-        self.assertEqual(parse.handle_machines, handler)
+        self.assertIsNone(handler)
         self.assertEqual(
             [
                 {
@@ -200,7 +575,7 @@ class TestHandleMachines(unittest.TestCase):
             ))
         })
         handler = parse.handle_machines(cs)
-        self.assertEqual(parse.handle_relations, handler)
+        self.assertIsNone(handler)
         self.assertEqual(
             [
                 {
@@ -229,6 +604,75 @@ class TestHandleMachines(unittest.TestCase):
         parse.handle_machines(cs)
         self.assertEqual([], cs.recv())
 
+    def test_constraint_string(self):
+        cs = parse.ChangeSet({
+            'machines': {
+                '1': {'constraints': 'mem=4G cores=2 arch=amd64'},
+            }
+        })
+        parse.handle_machines(cs)
+        self.assertEqual(
+            [
+                {
+                    'id': 'addMachine-0',
+                    'method': 'addMachine',
+                    'args': ['', {'mem': 4096, 'cores': 2, 'arch': 'amd64'}],
+                    'requires': []
+                },
+            ],
+            cs.recv())
+
+    def test_constraints_passthrough(self):
+        cs = parse.ChangeSet({
+            'machines': {
+                '1': {'constraints': 'mem=4GB allocate-public-ip=true'},
+            }
+        })
+        parse.handle_machines(cs)
+        self.assertEqual(
+            ['', {'mem': '4GB', 'allocate-public-ip': 'true'}],
+            cs.recv()[0]['args'])
+
+
+class TestGroupMachines(unittest.TestCase):
+
+    def test_group(self):
+        cs = parse.ChangeSet({
+            'machines': OrderedDict((
+                ('1', {'series': 'trusty', 'constraints': 'mem=4G'}),
+                ('2', {'series': 'trusty'}),
+                ('3', {'series': 'trusty', 'constraints': 'mem=4096M'}),
+                ('4', {'series': 'vivid', 'constraints': 'mem=4G'}),
+                ('5', {'series': 'trusty'}),
+            ))
+        })
+        parse.handle_machines(cs)
+        changes = cs.recv()
+        changes.insert(1, {'id': 'addCharm-9', 'method': 'addCharm'})
+        self.assertEqual(
+            [
+                ('trusty', {'mem': 4096}, ['addMachine-0', 'addMachine-2']),
+                ('trusty', {}, ['addMachine-1', 'addMachine-4']),
+                ('vivid', {'mem': 4096}, ['addMachine-3']),
+            ],
+            parse.group_machines(changes))
+
+    def test_group_unknown_constraints(self):
+        cs = parse.ChangeSet({
+            'machines': OrderedDict((
+                ('1', {'constraints': {'foo': {'a': 1}}}),
+                ('2', {'constraints': {'foo': {'a': 1}}}),
+                ('3', {'constraints': 'mem'}),
+            ))
+        })
+        parse.handle_machines(cs)
+        self.assertEqual(
+            [
+                ('', {'foo': {'a': 1}}, ['addMachine-0', 'addMachine-1']),
+                ('', 'mem', ['addMachine-2']),
+            ],
+            parse.group_machines(cs.recv()))
+
 
 class TestHandleRelations(unittest.TestCase):
 
@@ -248,7 +692,7 @@ class TestHandleRelations(unittest.TestCase):
         })
         parse.handle_services(cs)
         handler = parse.handle_relations(cs)
-        self.assertEqual(parse.handle_units, handler)
+        self.assertIsNone(handler)
         self.assertEqual(
             [
                 {
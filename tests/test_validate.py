@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_validate
+----------------------------------
+
+Tests for `validate` module.
+"""
+
+import unittest
+
+from bundleparser import validate
+
+
+class TestValidateBundle(unittest.TestCase):
+
+    def test_valid(self):
+        self.assertEqual([], validate.validate_bundle({
+            'services': {},
+            'machines': {
+                '1': {'constraints': 'mem=4G cores=2'},
+                '2': {},
+            },
+        }))
+
+    def test_invalid_constraints(self):
+        errors = validate.validate_bundle({
+            'services': {},
+            'machines': {'1': {'constraints': 'mem=lots'}},
+        })
+        self.assertEqual(1, len(errors))
+        self.assertTrue(errors[0].startswith('machine 1: '))
+
+    def test_unknown_constraint(self):
+        # Constraints not normalized by the parser are passed through.
+        errors = validate.validate_bundle({
+            'services': {},
+            'machines': {
+                '1': {'constraints': 'image-id=ami-1 allocate-public-ip=true'},
+                '2': {'constraints': {'instance-role': 'auto'}},
+            },
+        })
+        self.assertEqual([], errors)
+
+    def test_non_finite_size(self):
+        for value in ('inf', 'nan', '1e400'):
+            errors = validate.validate_bundle({
+                'services': {},
+                'machines': {'1': {'constraints': 'mem=' + value}},
+            })
+            self.assertEqual(1, len(errors))